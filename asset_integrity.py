@@ -0,0 +1,146 @@
+#!/usr/bin/python
+import os
+import struct
+import sys
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from optparse import OptionParser
+
+import log
+import metrics
+import sync_manifest
+
+##
+# Checks that the sign illustrations we have downloaded are whole PNGs, rather
+# than an error page or a file cut off part way through, either of which would
+# otherwise be kept and shipped in every later build. A file fails if:
+#
+#  - it doesn't start with the PNG signature and an IHDR chunk
+#  - it has no IEND chunk near its end, i.e. it has been truncated (a few
+#    encoders leave some padding after it, so it needn't be the last bytes)
+#  - with `decode`, Pillow can't decode every pixel of it
+#
+# Files that fail are moved into the .quarantine folder alongside the assets
+# and listed in QUARANTINE_LIST there, and forgotten by the sync manifest, so
+# that the next fetch downloads them again from scratch. Files that pass are
+# marked as verified in the manifest with their size and modification time,
+# so only new or changed files are checked on later runs.
+#
+#   python3 asset_integrity.py signbank-assets [--all] [--decode]
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# The empty IEND chunk every PNG ends with: length, type and CRC
+PNG_TRAILER = struct.pack(">I", 0) + b"IEND" + struct.pack(">I", zlib.crc32(b"IEND"))
+# Signature, IHDR chunk and IEND chunk
+PNG_MIN_SIZE = len(PNG_SIGNATURE) + 25 + len(PNG_TRAILER)
+TRAILER_SEARCH_BYTES = 4096
+
+QUARANTINE_FOLDER = ".quarantine"
+QUARANTINE_LIST = "quarantine.txt"
+DEFAULT_VERIFY_WORKERS = int(os.getenv("VERIFY_WORKERS", 8))
+
+logger = log.get_logger(__name__)
+
+
+def check_png(path, decode=False):
+    """
+    Returns why the file at `path` is not a whole PNG, or None if it is.
+    """
+    try:
+        size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            head = f.read(16)
+            f.seek(-min(size, TRAILER_SEARCH_BYTES), os.SEEK_END)
+            tail = f.read()
+    except OSError as e:
+        return str(e)
+    if not head.startswith(PNG_SIGNATURE):
+        return "not a PNG" + (" (looks like HTML)" if head.lstrip().startswith(b"<") else "")
+    if size < PNG_MIN_SIZE:
+        return f"only {size} bytes"
+    if head[12:16] != b"IHDR":
+        return "no IHDR chunk"
+    if PNG_TRAILER not in tail:
+        return "truncated, no IEND chunk"
+    if decode:
+        from PIL import Image
+        try:
+            with Image.open(path) as image:
+                image.load()
+        except Exception as e:
+            return f"can't be decoded: {e}"
+    return None
+
+
+def quarantine(folder, filename, reason, manifest=None):
+    """
+    Moves `filename` out of the asset folder into the quarantine folder,
+    replacing any earlier copy, and lists it with the reason. If given, the
+    sync manifest forgets it, so it is downloaded again without conditions.
+    """
+    quarantine_folder = os.path.join(folder, QUARANTINE_FOLDER)
+    os.makedirs(quarantine_folder, exist_ok=True)
+    os.replace(os.path.join(folder, filename), os.path.join(quarantine_folder, filename))
+    with open(os.path.join(quarantine_folder, QUARANTINE_LIST), "a") as f:
+        f.write(f"{time.strftime('%Y-%m-%dT%H:%M:%S%z')}\t{filename}\t{reason}\n")
+    if manifest is not None:
+        sync_manifest.forget(manifest, filename)
+    metrics.count("verify.quarantined")
+    logger.warning(f"Quarantined {filename}: {reason}", extra={"fields": {"filename": filename, "reason": reason}})
+
+
+def mark_verified(manifest, path):
+    stat = os.stat(path)
+    sync_manifest.record_verified(manifest, os.path.basename(path), stat.st_size, stat.st_mtime_ns)
+
+
+def verify_folder(folder, manifest, workers=DEFAULT_VERIFY_WORKERS, decode=False, everything=False):
+    """
+    Checks every PNG in `folder` that is new or has changed since it was last
+    verified (or every PNG at all, with `everything`) on a pool of threads,
+    quarantining any that fail. Returns the names of the files quarantined.
+    """
+    verified = {} if everything else sync_manifest.verified(manifest)
+    paths = []
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.name.endswith(".png") and not entry.name.startswith(".") and entry.is_file():
+                stat = entry.stat()
+                if verified.get(entry.name) != (stat.st_size, stat.st_mtime_ns):
+                    paths.append(entry.path)
+
+    quarantined = []
+    progress = log.Progress(logger, "Verifying images", total=len(paths), unit="images")
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        # Results are handled on this thread, which owns the manifest connection
+        for path, problem in zip(paths, executor.map(lambda path: check_png(path, decode), paths)):
+            progress.update()
+            if problem:
+                quarantine(folder, os.path.basename(path), problem, manifest)
+                quarantined.append(os.path.basename(path))
+            else:
+                mark_verified(manifest, path)
+    progress.finish()
+    manifest.commit()
+    metrics.count("verify.files", len(paths))
+    logger.info(f"Verified {len(paths)} images in {folder}, quarantined {len(quarantined)}")
+    return quarantined
+
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="%prog ASSET_FOLDER [--all] [--decode]")
+    parser.add_option("--all", action="store_true", dest="everything",
+                      help="Check every image, not just those that are new or changed since they were last checked")
+    parser.add_option("--decode", action="store_true", dest="decode", help="Also decode every image with Pillow")
+    parser.add_option("--workers", type="int", dest="workers", default=DEFAULT_VERIFY_WORKERS)
+    (options, args) = parser.parse_args()
+    if len(args) != 1:
+        parser.error("expected the asset folder to check")
+
+    log.configure()
+    manifest = sync_manifest.open_manifest(args[0])
+    quarantined = verify_folder(args[0], manifest, options.workers, options.decode, options.everything)
+    manifest.close()
+    if quarantined:
+        sys.exit(f"{len(quarantined)} images quarantined; fetch the assets again to replace them")
@@ -0,0 +1,136 @@
+#!/usr/bin/python
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import image_processing
+import signbank
+from fixture_server import FixtureServer
+
+##
+# Times each step of the Signbank build against the local fixture server, for
+# synthetic dictionaries of increasing size, so that the effect of a change can
+# be measured without Signbank credentials or S3:
+#
+#   python3 benchmarks/build_steps.py --sizes 100,1000 --output before.json
+#   (make a change)
+#   python3 benchmarks/build_steps.py --sizes 100,1000 --compare before.json
+#
+# Each step is run the way the build script runs it, with its own output
+# silenced. With --repeat, the fastest time for each step is reported.
+
+STEPS = ["fetch_gloss_export_file", "fetch_gloss_asset_export_file", "parse_signbank_csv", "write_sqlitefile",
+         "fetch_gloss_assets", "fetch_gloss_assets (revalidate)", "write_datfile", "copy_images_to_one_folder",
+         "process_images"]
+
+parser = OptionParser()
+parser.add_option("--sizes", dest="sizes", default="100,1000", help="Comma-separated numbers of glosses to export")
+parser.add_option("--repeat", type="int", dest="repeat", default=1, help="Times to run each size")
+parser.add_option("--latency", type="float", dest="latency", default=0.0,
+                  help="Seconds the fixture server delays every response by")
+parser.add_option("--image-size", dest="image_size", default="700x650", help="WIDTHxHEIGHT of the PNGs served")
+parser.add_option("--download-workers", type="int", dest="download_workers", default=8)
+parser.add_option("--image-workers", type="int", dest="image_workers", default=image_processing.DEFAULT_IMAGE_WORKERS)
+parser.add_option("--image-engine", dest="image_engine", default=image_processing.DEFAULT_IMAGE_ENGINE,
+                  choices=list(image_processing.ENGINES))
+parser.add_option("--skip-images", action="store_true", dest="skip_images",
+                  help="Don't time copy_images_to_one_folder and process_images")
+parser.add_option("--output", dest="output", help="Write the results to this JSON file")
+parser.add_option("--compare", dest="compare", help="Compare the results with a JSON file written by --output")
+(options, args) = parser.parse_args()
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_build(folder):
+    """
+    Runs each step of the build in `folder`, returning how long each took.
+    """
+    glosses_filename = os.path.join(folder, "signbank-glosses.csv")
+    assets_filename = os.path.join(folder, "signbank-gloss-assets.csv")
+    database_filename = os.path.join(folder, "nzsl.db")
+    assets_folder = os.path.join(folder, "signbank-assets")
+    pictures_folder = os.path.join(folder, "assets")
+
+    steps = {
+        "fetch_gloss_export_file": lambda: signbank.fetch_gloss_export_file(glosses_filename, {"published": "on"}),
+        "fetch_gloss_asset_export_file": lambda: signbank.fetch_gloss_asset_export_file(assets_filename),
+        "parse_signbank_csv": lambda: sum(1 for _ in signbank.parse_signbank_csv(glosses_filename)),
+        "write_sqlitefile": lambda: signbank.write_sqlitefile(signbank.parse_signbank_csv(glosses_filename),
+                                                              database_filename),
+        "fetch_gloss_assets": lambda: signbank.fetch_gloss_assets(
+            signbank.parse_signbank_csv(assets_filename), database_filename, assets_folder,
+            workers=options.download_workers),
+        "fetch_gloss_assets (revalidate)": lambda: signbank.fetch_gloss_assets(
+            signbank.parse_signbank_csv(assets_filename), database_filename, assets_folder,
+            workers=options.download_workers),
+        "write_datfile": lambda: signbank.write_datfile(database_filename, os.path.join(folder, "nzsl.dat")),
+        "copy_images_to_one_folder": lambda: signbank.copy_images_to_one_folder(assets_folder, pictures_folder),
+        "process_images": lambda: image_processing.process_images(pictures_folder, workers=options.image_workers,
+                                                                  engine=options.image_engine),
+    }
+    timings = {}
+    for name in STEPS:
+        if options.skip_images and name in ("copy_images_to_one_folder", "process_images"):
+            continue
+        started = time.perf_counter()
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            steps[name]()
+        timings[name] = round(time.perf_counter() - started, 4)
+    return timings
+
+
+width, height = (int(n) for n in options.image_size.split("x"))
+results = {}
+with FixtureServer(latency=options.latency, image_size=(width, height)) as server:
+    signbank.DEFAULT_SIGNBANK_HOST = server.url
+    signbank.SIGNBANK_USERNAME = signbank.SIGNBANK_PASSWORD = "benchmark"
+    for size in [int(s) for s in options.sizes.split(",")]:
+        server.glosses = size
+        server.export("glosses")
+        server.export("assets")
+        best = {}
+        for _ in range(options.repeat):
+            with tempfile.TemporaryDirectory() as tmp:
+                for name, seconds in run_build(tmp).items():
+                    best[name] = min(seconds, best.get(name, seconds))
+        results[str(size)] = best
+
+previous = None
+if options.compare:
+    with open(options.compare) as f:
+        previous = json.load(f)
+
+for size, timings in results.items():
+    print(f"{size} glosses")
+    for name, seconds in timings.items():
+        line = f"  {name:<34} {seconds:>9.3f}s"
+        before = (previous or {}).get("results", {}).get(size, {}).get(name)
+        if before:
+            line += f"  was {before:>9.3f}s ({(seconds - before) / before:+.0%})"
+        print(line)
+
+if options.output:
+    with open(options.output, "w") as f:
+        json.dump({
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "options": {"latency": options.latency, "image_size": options.image_size,
+                        "download_workers": options.download_workers, "image_workers": options.image_workers,
+                        "image_engine": options.image_engine, "repeat": options.repeat},
+            "results": results,
+        }, f, indent=2)
@@ -0,0 +1,195 @@
+#!/usr/bin/python
+import csv
+import io
+import secrets
+import struct
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from optparse import OptionParser
+from urllib.parse import parse_qs, urlsplit
+
+import synthetic
+
+##
+# A local stand-in for Signbank and the S3 bucket its assets are served from, so
+# that the build can be run and timed without credentials or network access. It
+# serves:
+#
+#  - /accounts/login/: the CSRF cookie and login form used by signbank_session
+#  - /dictionary/advanced/?format=CSV-standard: a synthetic gloss export, only
+#    to a logged in session (otherwise redirecting to the login page, as
+#    Signbank does)
+#  - /video/csv: the asset export for the same glosses
+#  - /media/<name>.png: a generated PNG of the configured size, with an ETag so
+#    conditional requests get a 304
+#
+# Every response is delayed by `latency` seconds. Run it on its own to point a
+# real build at it:
+#
+#   python3 benchmarks/fixture_server.py --port 8765 --glosses 1000 &
+#   SIGNBANK_HOST=http://127.0.0.1:8765 SIGNBANK_USERNAME=x SIGNBANK_PASSWORD=x \
+#       python3 build-assets-from-signbank.py
+
+
+def _png_chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def generate_png(width, height):
+    """
+    An RGB PNG of a dark outline on a white background, roughly like a sign
+    illustration, built with zlib so that Pillow isn't needed.
+    """
+    border = max(1, min(width, height) // 20)
+    rows = []
+    for y in range(height):
+        row = bytearray(b"\xff" * (width * 3))
+        for x in range(width):
+            if (x // border + y // border) % 7 == 0 or y < border or y >= height - border:
+                row[x * 3:x * 3 + 3] = b"\x20\x20\x20"
+        rows.append(b"\x00" + bytes(row))
+    return (b"\x89PNG\r\n\x1a\n"
+            + _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + _png_chunk(b"IDAT", zlib.compress(b"".join(rows), 6))
+            + _png_chunk(b"IEND", b""))
+
+
+def _csv(rows, fields):
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=fields)
+    writer.writeheader()
+    writer.writerows(rows)
+    return out.getvalue().encode()
+
+
+class FixtureServer:
+    """
+    Runs the fixture server on a background thread:
+
+        with FixtureServer(glosses=1000) as server:
+            signbank.DEFAULT_SIGNBANK_HOST = server.url
+    """
+
+    def __init__(self, glosses=100, latency=0.0, image_size=(700, 650), port=0):
+        self.glosses = glosses
+        self.latency = latency
+        self.png = generate_png(*image_size)
+        self.requests = 0
+        self._sessions = set()
+        self._exports = {}
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", port), _handler(self))
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def export(self, kind):
+        # Exports are generated once per size, as generating them isn't what is
+        # being measured
+        key = (kind, self.glosses)
+        with self._lock:
+            if key not in self._exports:
+                if kind == "glosses":
+                    self._exports[key] = _csv(synthetic.gloss_rows(self.glosses), synthetic.GLOSS_FIELDS)
+                else:
+                    self._exports[key] = _csv(synthetic.asset_rows(self.glosses, base_url=f"{self.url}/media"),
+                                              synthetic.ASSET_FIELDS)
+            return self._exports[key]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def _handler(server):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def respond(self, status, body=b"", headers=None):
+            with server._lock:
+                server.requests += 1
+            if server.latency:
+                time.sleep(server.latency)
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def cookies(self):
+            return dict(part.strip().split("=", 1) for part in self.headers.get("Cookie", "").split(";")
+                        if "=" in part)
+
+        def do_GET(self):
+            path = urlsplit(self.path).path
+            if path == "/accounts/login/":
+                self.respond(200, b"<form></form>", {"Set-Cookie": f"csrftoken={secrets.token_hex(16)}; Path=/"})
+            elif path == "/":
+                self.respond(200, b"Signbank")
+            elif path in ("/dictionary/advanced/", "/video/csv"):
+                if self.cookies().get("sessionid") not in server._sessions:
+                    self.respond(302, headers={"Location": f"/accounts/login/?next={path}"})
+                else:
+                    body = server.export("glosses" if path == "/dictionary/advanced/" else "assets")
+                    self.respond(200, body, {"Content-Type": "text/csv"})
+            elif path.startswith("/media/") and path.endswith(".png"):
+                etag = f'"{zlib.crc32(server.png):08x}"'
+                if self.headers.get("If-None-Match") == etag:
+                    self.respond(304, headers={"ETag": etag})
+                else:
+                    self.respond(200, server.png, {"Content-Type": "image/png", "ETag": etag})
+            else:
+                self.respond(404)
+
+        def do_POST(self):
+            form = parse_qs(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode())
+            token = form.get("csrfmiddlewaretoken", [None])[0]
+            if urlsplit(self.path).path != "/accounts/login/" or token != self.cookies().get("csrftoken"):
+                self.respond(403)
+                return
+            session_id = secrets.token_hex(16)
+            with server._lock:
+                server._sessions.add(session_id)
+            self.respond(302, headers={"Location": "/", "Set-Cookie": f"sessionid={session_id}; Path=/"})
+
+    return Handler
+
+
+if __name__ == "__main__":
+    parser = OptionParser()
+    parser.add_option("--port", type="int", dest="port", default=8765)
+    parser.add_option("--glosses", type="int", dest="glosses", default=1000, help="Number of glosses to export")
+    parser.add_option("--latency", type="float", dest="latency", default=0.0,
+                      help="Seconds to delay every response by")
+    parser.add_option("--image-size", dest="image_size", default="700x650", help="WIDTHxHEIGHT of the PNGs served")
+    (options, args) = parser.parse_args()
+
+    width, height = (int(n) for n in options.image_size.split("x"))
+    server = FixtureServer(options.glosses, options.latency, (width, height), options.port)
+    print(f"Serving {options.glosses} glosses at {server.url}", file=sys.stderr)
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
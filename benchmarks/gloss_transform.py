@@ -0,0 +1,52 @@
+#!/usr/bin/python
+import os
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import signbank
+import synthetic
+
+##
+# Measures how the throughput of turning export rows into database rows scales
+# with the number of worker processes, on its own and as part of
+# signbank.write_sqlitefile.
+#
+#   python3 benchmarks/gloss_transform.py --glosses 200000 --workers 1,2,4,8
+
+parser = OptionParser()
+parser.add_option("--glosses", type="int", dest="glosses", default=200000, help="Number of glosses to generate")
+parser.add_option("--workers", dest="workers", default=f"1,2,4,{os.cpu_count()}",
+                  help="Comma-separated numbers of worker processes to try")
+parser.add_option("--chunk-size", type="int", dest="chunk_size", default=signbank.SQLITE_BATCH_SIZE,
+                  help="Glosses per chunk")
+(options, args) = parser.parse_args()
+
+data = list(synthetic.gloss_rows(options.glosses))
+
+
+def transform(workers):
+    for _ in signbank.transform_glosses(data, workers, options.chunk_size):
+        pass
+
+
+def write(workers):
+    with tempfile.TemporaryDirectory() as tmp:
+        signbank.write_sqlitefile(data, os.path.join(tmp, "nzsl.db"), batch_size=options.chunk_size,
+                                  workers=workers)
+
+
+print(f"{'workers':>8} {'transform glosses/s':>20} {'speedup':>8} {'write glosses/s':>16} {'speedup':>8}")
+baseline = None
+for workers in sorted({int(w) for w in options.workers.split(",")}):
+    rates = []
+    for step in (transform, write):
+        started = time.perf_counter()
+        step(workers)
+        rates.append(options.glosses / (time.perf_counter() - started))
+    baseline = baseline or rates
+    print(f"{workers:>8} {rates[0]:>20.0f} {rates[0] / baseline[0]:>7.2f}x "
+          f"{rates[1]:>16.0f} {rates[1] / baseline[1]:>7.2f}x")
@@ -0,0 +1,149 @@
+#!/usr/bin/python
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageChops, ImageDraw, ImageStat
+
+import image_processing
+
+##
+# Checks that the Pillow image engine produces the same results as the
+# ImageMagick/optipng commands, and compares how long each takes. Every image is
+# processed by both engines, and the outputs are compared on:
+#
+#  - main image and thumbnail dimensions (to within a pixel, for rounding)
+#  - the main image palette: both have the same number of colours, at most 4,
+#    and each colour in either is within --colour-tolerance of one in the other
+#  - the main image and the thumbnail pixel by pixel, as seen on a white
+#    background: the mean difference of each channel must be within
+#    --pixel-tolerance
+#
+# Without --source, a set of illustration-like PNGs is generated. Exits non-zero
+# if any image differs.
+#
+#   python3 benchmarks/image_engine_parity.py --source signbank-assets
+
+parser = OptionParser()
+parser.add_option("--source", dest="source", help="Folder of PNGs to compare (default: generate some)")
+parser.add_option("--count", type="int", dest="count", default=50, help="Number of images to generate")
+parser.add_option("--workers", type="int", dest="workers", default=image_processing.DEFAULT_IMAGE_WORKERS)
+parser.add_option("--colour-tolerance", type="int", dest="colour_tolerance", default=8,
+                  help="Largest per-channel difference allowed between matching palette colours")
+parser.add_option("--pixel-tolerance", type="float", dest="pixel_tolerance", default=2.0,
+                  help="Largest mean per-channel difference allowed between the two engines' images, out of 255")
+(options, args) = parser.parse_args()
+
+
+def generate_images(folder, count, seed=1):
+    rng = random.Random(seed)
+    for i in range(count):
+        size = (rng.randint(300, 1200), rng.randint(300, 1200))
+        mode = rng.choice(["RGB", "RGBA", "P"])
+        image = Image.new("RGBA" if mode == "RGBA" else "RGB", size,
+                          (255, 255, 255, 0) if mode == "RGBA" else (255, 255, 255))
+        draw = ImageDraw.Draw(image)
+        draw.rectangle((0, 0, size[0] - 1, size[1] - 1), outline=(0, 0, 0))
+        for _ in range(rng.randint(5, 30)):
+            points = [(rng.randrange(size[0]), rng.randrange(size[1])) for _ in range(2)]
+            colour = rng.choice([(0, 0, 0), (40, 40, 40), (200, 30, 30), (30, 30, 200)])
+            draw.line(points, fill=colour, width=rng.randint(2, 8))
+        if mode == "P":
+            image = image.convert("P", palette=Image.Palette.ADAPTIVE, colors=16)
+        image.save(os.path.join(folder, f"image_{i:04d}.png"))
+
+
+def colours(path):
+    with Image.open(path) as image:
+        # The colour of a fully transparent pixel doesn't matter
+        return sorted({colour if colour[3] else (0, 0, 0, 0)
+                       for _, colour in image.convert("RGBA").getcolors(maxcolors=1 << 16) or []})
+
+
+def close_to_any(colour, candidates, tolerance):
+    return any(all(abs(a - b) <= tolerance for a, b in zip(colour, candidate)) for candidate in candidates)
+
+
+def on_white(path):
+    with Image.open(path) as image:
+        image = image.convert("RGBA")
+    return Image.alpha_composite(Image.new("RGBA", image.size, (255, 255, 255, 255)), image).convert("RGB")
+
+
+def compare_pixels(expected_path, actual_path):
+    """
+    The largest mean difference of any channel between the two images, after
+    scaling the second to the size of the first if they are a pixel apart.
+    """
+    expected = on_white(expected_path)
+    actual = on_white(actual_path)
+    if actual.size != expected.size:
+        actual = actual.resize(expected.size, Image.Resampling.LANCZOS)
+    return max(ImageStat.Stat(ImageChops.difference(expected, actual)).mean)
+
+
+def compare(filename, imagemagick_folder, pillow_folder):
+    problems = []
+    for prefix, name in (("", "main"), (image_processing.THUMBNAIL_PREFIX, "thumbnail")):
+        expected_path = os.path.join(imagemagick_folder, prefix + filename)
+        actual_path = os.path.join(pillow_folder, prefix + filename)
+        with Image.open(expected_path) as expected, Image.open(actual_path) as actual:
+            expected_size, actual_size = expected.size, actual.size
+        if any(abs(a - b) > 1 for a, b in zip(expected_size, actual_size)):
+            problems.append(f"{name} size {actual_size} != {expected_size}")
+            continue
+        difference = compare_pixels(expected_path, actual_path)
+        if difference > options.pixel_tolerance:
+            problems.append(f"{name} pixels differ by {difference:.1f} on average")
+
+    expected_colours = colours(os.path.join(imagemagick_folder, filename))
+    actual_colours = colours(os.path.join(pillow_folder, filename))
+    if len(actual_colours) > image_processing.IMAGE_COLOURS:
+        problems.append(f"{len(actual_colours)} colours")
+    if (len(actual_colours) != len(expected_colours)
+            or not all(close_to_any(c, expected_colours, options.colour_tolerance) for c in actual_colours)
+            or not all(close_to_any(c, actual_colours, options.colour_tolerance) for c in expected_colours)):
+        problems.append(f"palette {actual_colours} != {expected_colours}")
+    return problems
+
+
+for command in ("mogrify", "convert", "optipng"):
+    if not shutil.which(command):
+        sys.exit(f"{command} is required to compare against the ImageMagick engine")
+
+with tempfile.TemporaryDirectory() as tmp:
+    source = options.source
+    if not source:
+        source = os.path.join(tmp, "source")
+        os.makedirs(source)
+        generate_images(source, options.count)
+
+    timings = {}
+    folders = {}
+    for engine in ("imagemagick", "pillow"):
+        folders[engine] = os.path.join(tmp, engine)
+        shutil.copytree(source, folders[engine])
+        started = time.perf_counter()
+        failures = image_processing.process_images(folders[engine], workers=options.workers, engine=engine)
+        timings[engine] = time.perf_counter() - started
+        if failures:
+            sys.exit(f"{len(failures)} images failed with {engine}")
+
+    filenames = image_processing.images_to_process(source)
+    mismatches = 0
+    for filename in filenames:
+        problems = compare(filename, folders["imagemagick"], folders["pillow"])
+        if problems:
+            mismatches += 1
+            print(f"{filename}: {'; '.join(problems)}")
+
+    print(f"{len(filenames) - mismatches} of {len(filenames)} images match")
+    for engine, seconds in timings.items():
+        print(f"{engine}: {seconds:.1f}s ({len(filenames) / seconds:.1f} images/s)")
+    sys.exit(1 if mismatches else 0)
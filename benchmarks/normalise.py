@@ -0,0 +1,60 @@
+#!/usr/bin/python
+import os
+import random
+import sys
+import time
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import normalisation
+import synthetic
+
+##
+# Compares normalisation.normalise with the chain of str.replace calls it
+# replaced, over a large number of synthetic glosses, and checks that every
+# result is printable ASCII (as freelex.write_sqlitefile used to assert).
+#
+#   python3 benchmarks/normalise.py --strings 1000000
+
+
+def replace_chain(s):
+    return (s.lower()
+            .replace("ā", "a")
+            .replace("ē", "e")
+            .replace("é", "e")
+            .replace("ī", "i")
+            .replace("ō", "o")
+            .replace("ū", "u"))
+
+
+parser = OptionParser()
+parser.add_option("--strings", type="int", dest="strings", default=1000000, help="Number of strings to normalise")
+parser.add_option("--glosses", type="int", dest="glosses", default=10000,
+                  help="Number of synthetic glosses to draw the strings from")
+(options, args) = parser.parse_args()
+
+rng = random.Random(1)
+pool = []
+for row in synthetic.gloss_rows(options.glosses):
+    pool += [row["gloss_main"], row["gloss_secondary"], row["gloss_maori"], row["videoexample1_translation"]]
+pool += ["Māori", "MĀORI", "café", "Straße", "naïve", "don’t – wait", "Œuvre", "tab\there"]
+strings = [rng.choice(pool) for _ in range(options.strings)]
+
+candidates = {
+    "str.replace chain": replace_chain,
+    "normalise (uncached)": normalisation.normalise.__wrapped__,
+    "normalise": normalisation.normalise,
+}
+print(f"{len(strings)} strings, {len(set(strings))} distinct")
+for name, function in candidates.items():
+    normalisation.normalise.cache_clear()
+    started = time.perf_counter()
+    for s in strings:
+        function(s)
+    elapsed = time.perf_counter() - started
+    print(f"{name:<22} {elapsed:>8.3f}s {len(strings) / elapsed / 1_000_000:>8.2f}M strings/s")
+
+not_ascii = {s for s in set(strings) if not all(32 <= ord(c) < 127 for c in normalisation.normalise(s))}
+print("all results are printable ASCII" if not not_ascii else f"not printable ASCII: {sorted(not_ascii)[:10]}")
+sys.exit(1 if not_ascii else 0)
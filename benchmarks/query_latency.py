@@ -0,0 +1,77 @@
+#!/usr/bin/python
+import os
+import random
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import nzsl_query
+import signbank
+import synthetic
+
+##
+# Measures the p50 and p99 latency of each nzsl_query lookup, with the result
+# cache off (every lookup goes to SQLite) and on (after warming it with the
+# same lookups). Uses an existing database if given, otherwise generates one
+# with assets linked.
+#
+#   python3 benchmarks/query_latency.py --glosses 50000 [--database nzsl.db]
+
+parser = OptionParser()
+parser.add_option("--database", dest="database", help="nzsl.db to query (default: generate one)")
+parser.add_option("--glosses", type="int", dest="glosses", default=50000,
+                  help="Number of glosses to generate when no database is given")
+parser.add_option("--lookups", type="int", dest="lookups", default=2000, help="Number of each lookup to run")
+(options, args) = parser.parse_args()
+
+
+def percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def run(database_filename):
+    rng = random.Random(1)
+    with nzsl_query.Dictionary(database_filename, cache_size=0) as dictionary:
+        ids = [row["id"] for row in dictionary.db.execute("SELECT id FROM words")]
+        glosses = [row[0] for row in dictionary.db.execute("SELECT gloss_normalized FROM words WHERE gloss_normalized != ''")]
+        topics = [row["name"] for row in dictionary.topics()] or [""]
+    word_ids = [rng.choice(ids) for _ in range(options.lookups)]
+    terms = [rng.choice(glosses)[:rng.randint(2, 4)] for _ in range(options.lookups)]
+    lookups = {
+        "word": [(word_id,) for word_id in word_ids],
+        "search": [(term,) for term in terms],
+        "topics": [()] * options.lookups,
+        "topic_words": [(rng.choice(topics),) for _ in range(options.lookups)],
+        "videos": [(word_id,) for word_id in word_ids],
+        "examples": [(word_id,) for word_id in word_ids],
+    }
+
+    print(f"{'lookup':<12} {'cache':>6} {'p50 ms':>10} {'p99 ms':>10} {'max ms':>10}")
+    for cache_size in (0, options.lookups):
+        with nzsl_query.Dictionary(database_filename, cache_size=cache_size) as dictionary:
+            for name, calls in lookups.items():
+                lookup = getattr(dictionary, name)
+                if cache_size:
+                    for args in calls:
+                        lookup(*args)
+                timings = []
+                for args in calls:
+                    started = time.perf_counter()
+                    lookup(*args)
+                    timings.append(time.perf_counter() - started)
+                timings.sort()
+                print(f"{name:<12} {'on' if cache_size else 'off':>6} {1000 * percentile(timings, 50):>10.3f} "
+                      f"{1000 * percentile(timings, 99):>10.3f} {1000 * timings[-1]:>10.3f}")
+
+
+if options.database:
+    run(options.database)
+else:
+    with tempfile.TemporaryDirectory() as tmp:
+        database_filename = os.path.join(tmp, "nzsl.db")
+        signbank.write_sqlitefile(synthetic.gloss_rows(options.glosses), database_filename)
+        signbank.fetch_gloss_assets(synthetic.asset_rows(options.glosses), database_filename, tmp, download=False)
+        run(database_filename)
@@ -0,0 +1,73 @@
+#!/usr/bin/python
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import signbank
+import synthetic
+
+##
+# Compares the cost of searching nzsl.db the way the apps do today (LIKE over
+# words.target) with the words_search full text index and the gloss_normalized
+# index. Uses an existing database built with --search-index if given, otherwise
+# generates a synthetic one.
+#
+#   python3 benchmarks/search_queries.py --database nzsl.db
+#
+# Note that the queries are not equivalent: LIKE '%term%' matches anywhere in the
+# text, the FTS query matches words starting with the term, and the index query
+# matches glosses starting with it. A term that matches nothing shows the worst
+# case, where LIKE has to scan every row.
+
+parser = OptionParser()
+parser.add_option("--database", dest="database", help="nzsl.db built with --search-index (default: generate one)")
+parser.add_option("--glosses", type="int", dest="glosses", default=50000,
+                  help="Number of glosses to generate when no database is given")
+parser.add_option("--queries", type="int", dest="queries", default=200, help="Number of searches to run")
+parser.add_option("--limit", type="int", dest="limit", default=50,
+                  help="Maximum results per search, as an app would show a page of results")
+(options, args) = parser.parse_args()
+
+QUERIES = {
+    "LIKE on target": "SELECT id FROM words WHERE target LIKE '%' || :term || '%' LIMIT :limit",
+    "FTS5 prefix": "SELECT word_id FROM words_search WHERE words_search MATCH :fts_term LIMIT :limit",
+    "gloss_normalized index": "SELECT id FROM words WHERE gloss_normalized >= :term"
+                              " AND gloss_normalized < :term || char(1114111) LIMIT :limit",
+}
+
+
+def run(database_filename):
+    db = sqlite3.connect(database_filename)
+    rng = random.Random(1)
+    glosses = [gloss for (gloss,) in db.execute("SELECT gloss_normalized FROM words WHERE gloss_normalized != ''")]
+    terms = [gloss[:rng.randint(2, 4)] for gloss in rng.sample(glosses, min(options.queries, len(glosses)))]
+    # Include some searches with no results, which is the worst case for LIKE
+    terms += ["zqx"] * max(1, len(terms) // 10)
+
+    print(f"{'query':<25} {'mean ms':>10} {'max ms':>10} {'rows/query':>12}")
+    for name, sql in QUERIES.items():
+        timings = []
+        rows = 0
+        for term in terms:
+            params = {"term": term, "fts_term": '"' + term.replace('"', '""') + '"*', "limit": options.limit}
+            started = time.perf_counter()
+            rows += len(db.execute(sql, params).fetchall())
+            timings.append(time.perf_counter() - started)
+        print(f"{name:<25} {1000 * sum(timings) / len(timings):>10.3f} {1000 * max(timings):>10.3f} "
+              f"{rows / len(terms):>12.1f}")
+    db.close()
+
+
+if options.database:
+    run(options.database)
+else:
+    with tempfile.TemporaryDirectory() as tmp:
+        database_filename = os.path.join(tmp, "nzsl.db")
+        signbank.write_sqlitefile(synthetic.gloss_rows(options.glosses), database_filename, search_index=True)
+        run(database_filename)
@@ -0,0 +1,40 @@
+#!/usr/bin/python
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import signbank
+import synthetic
+
+##
+# Measures how quickly signbank.write_sqlitefile loads synthetic dictionaries of
+# increasing size.
+#
+#   python3 benchmarks/sqlite_writer.py --sizes 10000,50000,100000
+
+parser = OptionParser()
+parser.add_option("--sizes", dest="sizes", default="10000,50000,100000",
+                  help="Comma-separated numbers of glosses to generate")
+parser.add_option("--batch-size", type="int", dest="batch_size", default=signbank.SQLITE_BATCH_SIZE,
+                  help="Rows per executemany batch")
+(options, args) = parser.parse_args()
+
+print(f"{'glosses':>10} {'rows':>10} {'seconds':>10} {'rows/s':>12}")
+with tempfile.TemporaryDirectory() as tmp:
+    database_filename = os.path.join(tmp, "nzsl.db")
+    for size in [int(s) for s in options.sizes.split(",")]:
+        data = list(synthetic.gloss_rows(size))
+        started = time.perf_counter()
+        signbank.write_sqlitefile(data, database_filename, batch_size=options.batch_size)
+        elapsed = time.perf_counter() - started
+
+        db = sqlite3.connect(database_filename)
+        rows = sum(db.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+                   for table in ("words", "examples", "topics", "word_topics"))
+        db.close()
+        print(f"{size:>10} {rows:>10} {elapsed:>10.2f} {rows / elapsed:>12.0f}")
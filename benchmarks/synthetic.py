@@ -0,0 +1,82 @@
+import random
+
+##
+# Generators for synthetic Signbank exports, shaped like the `CSV-standard` gloss
+# export and the `/video/csv` asset export, for benchmarking without access to
+# Signbank. Output is deterministic for a given seed.
+
+SYLLABLES = ["ka", "ta", "ra", "no", "mi", "we", "hu", "pō", "ā", "ē", "ī", "ū", "sign", "deaf", "go", "eat"]
+HANDSHAPES = ["1.1.1", "1.2.1", "2.1.1", "3.1.1", "4.1.1", "5.1.1", "6.1.1", "7.1.1"]
+LOCATIONS = ["01 - in front of body", "02 - in front of face", "03 - head", "04 - top of head",
+             "05 - eyes", "06 - nose", "07 - ear", "08 - cheek", "09 - lower head", "10 - neck"]
+TOPICS = ["Animals", "Body", "Clothing", "Colours", "Communication", "Education", "Emotions",
+          "Family", "Food", "Health", "Maori", "Numbers", "People", "Places", "Sport", "Time"]
+
+GLOSS_FIELDS = [
+    "id", "gloss_main", "gloss_secondary", "gloss_maori", "handshape", "location_name", "variant_number",
+    "age_groups", "contains_numbers", "hint", "inflection_manner_and_degree", "inflection_plural",
+    "inflection_temporal", "is_directional", "is_fingerspelling", "is_locatable", "one_or_two_handed",
+    "related_to", "usage", "usage_notes", "word_classes", "semantic_field",
+    "videoexample1", "videoexample1_translation", "videoexample2", "videoexample2_translation",
+    "videoexample3", "videoexample3_translation", "videoexample4", "videoexample4_translation",
+]
+ASSET_FIELDS = ["Gloss", "Title", "Video_type", "Videofile", "Version"]
+
+
+def _word(rng, syllables=3):
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, syllables)))
+
+
+def _flag(rng):
+    return rng.choice(["True", "False"])
+
+
+def gloss_rows(count, seed=1):
+    rng = random.Random(seed)
+    for i in range(1, count + 1):
+        row = {
+            "id": str(i),
+            "gloss_main": _word(rng).upper(),
+            "gloss_secondary": ", ".join(_word(rng) for _ in range(rng.randint(0, 3))),
+            "gloss_maori": _word(rng) if rng.random() < 0.5 else "",
+            "handshape": rng.choice(HANDSHAPES),
+            "location_name": rng.choice(LOCATIONS),
+            "variant_number": str(rng.randint(1, 3)),
+            "age_groups": rng.choice(["", "youth", "older"]),
+            "contains_numbers": _flag(rng),
+            "hint": "",
+            "inflection_manner_and_degree": _flag(rng),
+            "inflection_plural": _flag(rng),
+            "inflection_temporal": _flag(rng),
+            "is_directional": _flag(rng),
+            "is_fingerspelling": _flag(rng),
+            "is_locatable": _flag(rng),
+            "one_or_two_handed": _flag(rng),
+            "related_to": "",
+            "usage": rng.choice(["", "informal", "neologism"]),
+            "usage_notes": " ".join(_word(rng) for _ in range(rng.randint(0, 8))),
+            "word_classes": rng.choice(["noun", "verb", "noun; verb", "adjective"]),
+            "semantic_field": "; ".join(rng.sample(TOPICS, rng.randint(0, 3))),
+        }
+        for n in range(1, 5):
+            has_example = n <= rng.randint(0, 4)
+            row[f"videoexample{n}"] = " ".join(_word(rng).upper() for _ in range(4)) if has_example else ""
+            row[f"videoexample{n}_translation"] = " ".join(_word(rng) for _ in range(6)) if has_example else ""
+        yield row
+
+
+def asset_rows(count, base_url="https://example.com/assets", seed=1):
+    """
+    Asset rows for `count` glosses: a main picture and video for each, and
+    example videos for some.
+    """
+    rng = random.Random(seed)
+    for i in range(1, count + 1):
+        gloss = f"{_word(rng).upper()}:{i}"
+        yield {"Gloss": gloss, "Title": f"{i}-illustration.png", "Video_type": "main",
+               "Videofile": f"{base_url}/{i}-illustration.png", "Version": "0"}
+        yield {"Gloss": gloss, "Title": f"{i}-main.mp4", "Video_type": "main",
+               "Videofile": f"{base_url}/{i}-main.mp4", "Version": "0"}
+        for n in range(1, rng.randint(0, 4) + 1):
+            yield {"Gloss": gloss, "Title": f"{i}-finalexample{n}.mp4", "Video_type": f"finalexample{n}",
+                   "Videofile": f"{base_url}/{i}-finalexample{n}.mp4", "Version": str(n)}
@@ -6,12 +6,15 @@ import xml.etree.ElementTree as ET
 from optparse import OptionParser
 
 import freelex
+import image_processing
+import log
 
 parser = OptionParser()
 parser.add_option("-c", action="store_true", dest="cleanup",
                   help="clean up files after execution")
 
 (options, args) = parser.parse_args()
+log.configure()
 
 filename = 'dnzsl-xmldump.xml'
 
@@ -45,7 +48,7 @@ print("Step 6: Merge images together into one folder")
 freelex.copy_images_to_one_folder()
 
 print("Step 7: Prepare images for distribution")
-image_processing.process_images(pictures_folder)
+image_processing.process_images(image_processing.PICTURES_FOLDER)
 
 if options.cleanup:
     print("Step 8: Cleanup")
@@ -1,9 +1,18 @@
 #!/usr/bin/python
+import multiprocessing
 import os
 import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor
 from optparse import OptionParser
 
+import downloader
+import image_cache
 import image_processing
+import log
+import metrics
+import pipeline
+import release_package
 import signbank
 
 parser = OptionParser()
@@ -13,8 +22,59 @@ parser.add_option("--skip-assets", action="store_true", help="Export Signbank da
 parser.add_option("--prerelease", action="store_true",
                                   help="Export prerelease Signbank data rather than published data",
                                   dest="prerelease")
+parser.add_option("--variants", dest="variants",
+                  help="Build several datasets in one run, in parallel, from shared exports and assets "
+                       "(comma-separated: published, prerelease). Each is written to its own folder in --output-dir")
+parser.add_option("--output-dir", dest="output_dir", default="build",
+                  help="Folder to write each of the --variants to (default build)")
+parser.add_option("--stage", dest="stage",
+                  help="Run only the named stage, whether or not it is up to date (see --list-stages)")
+parser.add_option("--list-stages", action="store_true", dest="list_stages",
+                  help="List the stages of the build and exit")
+parser.add_option("--resume", action="store_true", dest="resume",
+                  help="Resume a failed build from the first stage that is not up to date, rather than running every stage")
+parser.add_option("--search-index", action="store_true", dest="search_index",
+                  help="Add a full text search index (words_search, using FTS5) to nzsl.db")
+parser.add_option("--transform-workers", type="int", dest="transform_workers",
+                  default=signbank.SQLITE_TRANSFORM_WORKERS,
+                  help="Processes turning large exports into database rows (default 1, or SQLITE_TRANSFORM_WORKERS)")
+parser.add_option("--compress", dest="compress", default="",
+                  help="Also write compressed copies of nzsl.db (comma-separated: gz, zst), listed in SHA256SUMS")
+parser.add_option("--download-workers", type="int", dest="download_workers",
+                  default=downloader.DEFAULT_DOWNLOAD_WORKERS,
+                  help="Number of assets to download from Signbank concurrently")
+parser.add_option("--skip-revalidation", action="store_true", dest="skip_revalidation",
+                  help="Trust previously downloaded assets recorded in the sync manifest rather than checking them for changes")
+parser.add_option("--verify-all", action="store_true", dest="verify_all",
+                  help="Check every downloaded asset is a whole PNG, not just those new or changed since the last check")
+parser.add_option("--verify-decode", action="store_true", dest="verify_decode",
+                  help="Also decode each asset checked with Pillow")
+parser.add_option("--image-workers", type="int", dest="image_workers",
+                  default=image_processing.DEFAULT_IMAGE_WORKERS,
+                  help="Number of images to process in parallel (defaults to the number of CPUs)")
+parser.add_option("--image-engine", dest="image_engine", default=image_processing.DEFAULT_IMAGE_ENGINE,
+                  choices=list(image_processing.ENGINES),
+                  help="Process images with ImageMagick commands (imagemagick, the default) or, experimentally, "
+                       "in-process with Pillow (pillow)")
+parser.add_option("--image-cache", dest="image_cache", default=image_cache.DEFAULT_IMAGE_CACHE_DIR,
+                  help="Folder to cache processed images in, so unchanged images are not processed again")
+parser.add_option("--no-image-cache", action="store_true", dest="no_image_cache",
+                  help="Process every image, without reading or updating the image cache")
+parser.add_option("--log-level", dest="log_level", default=log.DEFAULT_LOG_LEVEL, choices=log.LEVELS,
+                  help="Show log messages at this level and above; DEBUG includes every asset and command")
+parser.add_option("--log-format", dest="log_format", default=log.DEFAULT_LOG_FORMAT, choices=["text", "json"],
+                  help="Log as plain text, or as one JSON object per line")
+parser.add_option("--metrics", dest="metrics", default=metrics.DEFAULT_METRICS_FILENAME,
+                  help="Write timings and counts for the build to this JSON file")
+parser.add_option("--profile", dest="profile", choices=metrics.PROFILERS,
+                  help="Profile each stage that is run with cprofile or tracemalloc, saving the results in "
+                       + metrics.DEFAULT_PROFILE_DIR)
+parser.add_option("--overlap", action="store_true", dest="overlap",
+                  help="Process images while the rest are still downloading, rather than in separate stages afterwards")
 
 (options, args) = parser.parse_args()
+log.configure(options.log_level, options.log_format)
+logger = log.get_logger("build")
 
 filename = 'signbank-glosses.csv'
 prerelease_filename = 'signbank-glosses-prerelease.csv'
@@ -25,51 +85,206 @@ assets_folder = 'signbank-assets'
 pictures_folder = 'assets'
 download = not options.skip_assets
 
+##
+# The exports each dataset variant is built from. Glosses in more than one of
+# them are merged by id, keeping the first.
+
+VARIANT_EXPORTS = {
+    "published": [filename],
+    "prerelease": [filename, prerelease_filename],
+}
+variants = [v for v in (options.variants or "").split(",") if v]
+for variant in variants:
+    if variant not in VARIANT_EXPORTS:
+        parser.error(f"unknown variant {variant!r}, expected one of {', '.join(VARIANT_EXPORTS)}")
+if variants and options.prerelease:
+    parser.error("--prerelease can't be combined with --variants; add prerelease to the variants instead")
+# The image workers would have to be forked alongside the variant processes,
+# and forking either lot once the other's executor has started its threads
+# isn't safe
+if variants and options.overlap:
+    parser.error("--overlap can't be combined with --variants")
+fetch_prerelease = options.prerelease or "prerelease" in variants
+compressions = [c for c in options.compress.split(",") if c]
+try:
+    release_package.check_compressions(compressions)
+except (ValueError, ImportError) as e:
+    parser.error(str(e))
+# Images are processed as they are downloaded, so there is nothing to overlap
+# with if assets aren't being downloaded
+overlap = download and options.overlap
+
 filters = {}
 if options.prerelease:
     filters['tags'] = signbank.SIGNBANK_WEB_READY_TAG_ID
 else:
     filters['published'] = 'on'
 
-print("Step 1: Fetching the latest published signs from Signbank")
-signbank.fetch_gloss_export_file(filename, { 'published': 'on' })
-data = signbank.parse_signbank_csv(filename)
 
-if options.prerelease:
-    print("Step 1a: Fetching the latest prerelease signs from Signbank")
-    signbank.fetch_gloss_export_file(prerelease_filename, { 'tags': signbank.SIGNBANK_WEB_READY_TAG_ID })
-    data += signbank.parse_signbank_csv(prerelease_filename)
+def fetch_exports():
+    logger.info("Fetching the latest published signs from Signbank")
+    signbank.fetch_gloss_export_file(filename, { 'published': 'on' })
+
+    if fetch_prerelease:
+        logger.info("Fetching the latest prerelease signs from Signbank")
+        signbank.fetch_gloss_export_file(prerelease_filename, { 'tags': signbank.SIGNBANK_WEB_READY_TAG_ID })
+
+    logger.info("Fetching the list of assets from Signbank")
+    signbank.fetch_gloss_asset_export_file(video_filename)
+
+
+def build_database():
+    exports = VARIANT_EXPORTS["prerelease" if options.prerelease else "published"]
+    data = signbank.merge_glosses(*(signbank.parse_signbank_csv(f) for f in exports))
+    signbank.write_sqlitefile(data, database_filename, search_index=options.search_index,
+                              workers=options.transform_workers)
+
+
+def image_options():
+    return dict(workers=options.image_workers, engine=options.image_engine,
+                cache_dir=None if options.no_image_cache else options.image_cache)
 
-print("Step 2: Write out sqlite nzsl.db for iOS")
-signbank.write_sqlitefile(data, database_filename)
 
+def fetch_assets(database_filename=database_filename):
+    asset_data = signbank.parse_signbank_csv(video_filename)
+    image_queue = image_processing.ImageQueue(pictures_folder, **image_options()) if overlap else None
+    try:
+        signbank.fetch_gloss_assets(asset_data, database_filename, assets_folder, download=download,
+                                    workers=options.download_workers, revalidate=not options.skip_revalidation,
+                                    on_image=image_queue.add if image_queue else None,
+                                    verify_all=options.verify_all, decode=options.verify_decode)
+    except downloader.DownloadsFailed as e:
+        raise pipeline.StageFailed(str(e)) from e
+    finally:
+        # Images that did download are still processed if others failed
+        image_failures = image_queue.finish() if image_queue else []
+    if image_failures:
+        raise pipeline.StageFailed(f"{len(image_failures)} images failed to process")
 
-print("Step 3: Fetching assets from signbank")
-signbank.fetch_gloss_asset_export_file(video_filename)
 
-asset_data = signbank.parse_signbank_csv(video_filename)
-signbank.fetch_gloss_assets(asset_data, database_filename, assets_folder, download=download)
-signbank.prune_orphan_assets(database_filename)
+def process_images():
+    failures = image_processing.process_images(pictures_folder, **image_options())
+    if failures:
+        raise pipeline.StageFailed(f"{len(failures)} images failed to process")
 
-print("Step 4: Write out nzsl.dat for Android")
-signbank.write_datfile(database_filename, dat_file_filename)
 
-if download:
-    print("Step 5: Merge images together into one folder")
-    signbank.copy_images_to_one_folder(assets_folder, pictures_folder)
+def variant_filenames(variant):
+    folder = os.path.join(options.output_dir, variant)
+    return (os.path.join(folder, database_filename), os.path.join(folder, dat_file_filename))
+
+
+def build_variant(variant):
+    """
+    Builds the database and dat file for one variant in its folder. Assets are
+    linked to signs without being downloaded, as the build downloads them once
+    for every variant. Returns the metrics recorded, to be merged into the
+    parent's.
+    """
+    # Drop whatever was inherited from the parent, which it already has
+    metrics.take()
+    variant_database, variant_dat = variant_filenames(variant)
+    os.makedirs(os.path.dirname(variant_database), exist_ok=True)
+    data = signbank.merge_glosses(*(signbank.parse_signbank_csv(f) for f in VARIANT_EXPORTS[variant]))
+    signbank.write_sqlitefile(data, variant_database, search_index=options.search_index,
+                              workers=options.transform_workers)
+    signbank.fetch_gloss_assets(signbank.parse_signbank_csv(video_filename), variant_database, assets_folder,
+                                download=False)
+    signbank.prune_orphan_assets(variant_database)
+    release_package.package_database(variant_database, compressions, dat_filename=variant_dat)
+    return metrics.take()
+
+
+def build_variants():
+    # Each variant is built in its own process while this one downloads the
+    # assets they share. The processes are forked before the download threads
+    # start, as forking a process with other threads running isn't safe.
+    with ProcessPoolExecutor(max_workers=len(variants), mp_context=multiprocessing.get_context("fork")) as executor:
+        futures = [executor.submit(build_variant, variant) for variant in variants]
+        if download:
+            fetch_assets(None)
+        for future in futures:
+            metrics.merge(future.result())
+
+
+export_filenames = [filename, video_filename] + ([prerelease_filename] if fetch_prerelease else [])
+stages = [
+    pipeline.Stage("fetch-exports", "Fetch the latest sign and asset exports from Signbank", fetch_exports,
+                   outputs=export_filenames,
+                   options={"prerelease": fetch_prerelease, "host": signbank.DEFAULT_SIGNBANK_HOST,
+                            "dataset": signbank.SIGNBANK_DATASET_ID}),
+]
+variant_outputs = [f for variant in variants for f in variant_filenames(variant)]
+if variants:
+    stages += [
+        pipeline.Stage("build-variants", f"Build the {', '.join(variants)} databases in parallel, "
+                                         "and fetch the assets they share", build_variants,
+                       inputs=export_filenames,
+                       outputs=variant_outputs + ([assets_folder] if download else []),
+                       options={"variants": variants, "search_index": options.search_index, "download": download,
+                                "revalidate": not options.skip_revalidation,
+                                "verify_all": options.verify_all, "verify_decode": options.verify_decode,
+                                "compress": compressions, "page_size": release_package.DEFAULT_PAGE_SIZE}),
+    ]
+else:
+    stages += [
+        pipeline.Stage("build-db", "Write out sqlite nzsl.db for iOS", build_database,
+                       inputs=[f for f in export_filenames if f != video_filename], outputs=[database_filename],
+                       options={"search_index": options.search_index}),
+        pipeline.Stage("fetch-assets", "Fetch assets from Signbank and link them to signs", fetch_assets,
+                       inputs=[video_filename],
+                       outputs=[database_filename] + ([assets_folder] if download else []) + ([pictures_folder] if overlap else []),
+                       options={"download": download, "revalidate": not options.skip_revalidation,
+                                "verify_all": options.verify_all, "verify_decode": options.verify_decode,
+                                "overlap": overlap, "engine": options.image_engine if overlap else None}),
+        pipeline.Stage("prune", "Remove assets not associated with a sign",
+                       lambda: signbank.prune_orphan_assets(database_filename), outputs=[database_filename]),
+        pipeline.Stage("finalise-db", "Order, analyse and compact nzsl.db, and write nzsl.dat for Android from it",
+                       lambda: release_package.package_database(database_filename, compressions,
+                                                                dat_filename=dat_file_filename),
+                       outputs=release_package.artefact_filenames(database_filename, compressions) + [dat_file_filename],
+                       options={"compress": compressions, "page_size": release_package.DEFAULT_PAGE_SIZE}),
+    ]
+if download and not overlap:
+    stages += [
+        pipeline.Stage("merge-images", "Merge images together into one folder",
+                       lambda: signbank.copy_images_to_one_folder(assets_folder, pictures_folder),
+                       inputs=[assets_folder], outputs=[pictures_folder]),
+        # Images are processed in place, so a partly processed folder has to be
+        # merged again before processing can be retried
+        pipeline.Stage("process-images", "Prepare images for distribution", process_images,
+                       outputs=[pictures_folder], options={"engine": options.image_engine},
+                       rerun_with=["merge-images"]),
+    ]
+
+if options.list_stages:
+    for stage in stages:
+        print(f"{stage.name}: {stage.description}")
+    sys.exit(0)
 
-    print("Step 6: Prepare images for distribution")
-    image_processing.process_images(pictures_folder)
+# The data in Signbank changes between builds, so every stage is run unless
+# resuming a build that failed
+failure = None
+try:
+    pipeline.run_stages(stages, only=options.stage, fresh=not options.resume and options.stage is None,
+                        profile=options.profile)
+except pipeline.StageFailed as e:
+    failure = e
+metrics.print_summary(metrics.write_report(options.metrics, prerelease=bool(options.prerelease), variants=variants,
+                                           download=download, image_engine=options.image_engine,
+                                           failed=str(failure) if failure else None))
+if failure:
+    sys.exit(f"Build failed: {failure}. Fix the problem and run again with --resume to carry on from there")
 
 if options.cleanup:
-    print("Step 7: Cleanup")
-    os.remove(filename)
-    os.remove(prerelease_filename)
-    os.remove(dat_file_filename)
-    os.remove(database_filename)
-    shutil.rmtree(pictures_folder)
-    shutil.rmtree(assets_folder)
+    logger.info("Cleanup")
+    for f in (export_filenames + [dat_file_filename, pipeline.DEFAULT_STATE_FILENAME]
+              + release_package.artefact_filenames(database_filename, compressions)):
+        if os.path.exists(f):
+            os.remove(f)
+    for folder in [pictures_folder, assets_folder] + ([options.output_dir] if variants else []):
+        if os.path.isdir(folder):
+            shutil.rmtree(folder)
 else:
-    print("Skipping cleanup (see --help for how to enable it)")
+    logger.info("Skipping cleanup (see --help for how to enable it)")
 
-print("Done")
+logger.info("Done")
@@ -0,0 +1,147 @@
+#!/usr/bin/python
+import sqlite3
+import sys
+from collections import namedtuple
+from optparse import OptionParser
+
+import log
+
+##
+# nzsl.dat, the dictionary format the Android application reads instead of
+# SQLite, for historical reasons. It only includes the data the application
+# needs: one line per word, with these tab-separated fields taken from the
+# words table of nzsl.db.
+#
+#   python3 datfile.py validate nzsl.dat [--database nzsl.db]
+
+DatEntry = namedtuple("DatEntry", ["gloss", "minor", "maori", "picture", "video", "handshape", "location"])
+
+DAT_COLUMNS = list(DatEntry._fields)
+DAT_QUERY = f"SELECT {', '.join(DAT_COLUMNS)} FROM words ORDER BY rowid"
+
+# Large enough that the file is written in a few hundred writes rather than
+# one per line
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+# A tab or line break inside a field would split the line it is on, so they
+# are written as spaces
+_SEPARATORS = str.maketrans("\t\r\n", "   ")
+
+logger = log.get_logger(__name__)
+
+
+def format_line(row):
+    """
+    The line of nzsl.dat for a row holding the DAT_COLUMNS of a word, in order.
+    """
+    return "\t".join([(value or "").translate(_SEPARATORS) for value in row]) + "\n"
+
+
+class DatWriter:
+    """
+    Writes nzsl.dat a row at a time, e.g. while the same rows are written to
+    the database:
+
+        with DatWriter("nzsl.dat") as dat:
+            for row in rows:
+                dat.write(row)
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lines = 0
+        self._file = open(filename, "w", encoding="utf-8", newline="", buffering=WRITE_BUFFER_SIZE)
+
+    def write(self, row):
+        self._file.write(format_line(row))
+        self.lines += 1
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def write_datfile(db, dat_file_filename):
+    """
+    Writes nzsl.dat from the words table of an open database connection,
+    returning the number of lines written.
+    """
+    with DatWriter(dat_file_filename) as dat:
+        for row in db.execute(DAT_QUERY):
+            dat.write(row)
+    return dat.lines
+
+
+def _entries(filename):
+    # (line number, DatEntry or None if the line has the wrong number of fields, field count)
+    with open(filename, encoding="utf-8", newline="") as f:
+        for line_number, line in enumerate(f, 1):
+            fields = line.rstrip("\r\n").split("\t")
+            yield line_number, DatEntry(*fields) if len(fields) == len(DAT_COLUMNS) else None, len(fields)
+
+
+def read_datfile(filename):
+    """
+    Yields a DatEntry for each line of a .dat file, reading it a line at a
+    time. Raises ValueError for a line without the right number of fields.
+    """
+    for line_number, entry, field_count in _entries(filename):
+        if entry is None:
+            raise ValueError(f"{filename}:{line_number}: expected {len(DAT_COLUMNS)} fields, got {field_count}")
+        yield entry
+
+
+def validate_datfile(filename, database_filename=None):
+    """
+    Checks every line of a .dat file can be read and names a word, and if a
+    database is given, that the file holds exactly the words in it, in order.
+    Returns a list of the problems found; both files are streamed rather than
+    loaded into memory.
+    """
+    problems = []
+    db = rows = None
+    if database_filename:
+        db = sqlite3.connect(f"file:{database_filename}?mode=ro", uri=True)
+        rows = db.execute(DAT_QUERY)
+
+    lines = 0
+    for lines, entry, field_count in _entries(filename):
+        row = rows.fetchone() if rows is not None else None
+        if rows is not None and row is None:
+            problems.append(f"line {lines}: not in {database_filename}")
+            rows = None
+        if entry is None:
+            problems.append(f"line {lines}: expected {len(DAT_COLUMNS)} fields, got {field_count}")
+            continue
+        if not entry.gloss:
+            problems.append(f"line {lines}: no gloss")
+        if entry.picture and not entry.picture.endswith(".png"):
+            problems.append(f"line {lines}: picture {entry.picture!r} is not a PNG")
+        if row is not None and format_line(row) != format_line(entry):
+            problems.append(f"line {lines}: {entry!r} does not match {DatEntry(*row)!r}")
+    if rows is not None and rows.fetchone() is not None:
+        problems.append(f"{database_filename} has more words than the {lines} lines of {filename}")
+    if db is not None:
+        db.close()
+    return problems
+
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="%prog validate DAT_FILE [--database DB]")
+    parser.add_option("--database", dest="database", help="Check the file holds exactly the words in this database")
+    (options, args) = parser.parse_args()
+    if len(args) != 2 or args[0] != "validate":
+        parser.error("expected validate DAT_FILE")
+
+    log.configure()
+    problems = validate_datfile(args[1], options.database)
+    for problem in problems[:100]:
+        logger.error(problem)
+    if problems:
+        sys.exit(f"{len(problems)} problems found in {args[1]}")
+    logger.info(f"{args[1]} is valid")
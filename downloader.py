@@ -0,0 +1,135 @@
+import hashlib
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import filesystem
+import metrics
+
+DEFAULT_DOWNLOAD_WORKERS = int(os.getenv("SIGNBANK_DOWNLOAD_WORKERS", 8))
+
+##
+# A single file to be downloaded, and the outcome of trying to download it.
+# `key` is opaque to the downloader and is handed back untouched so the caller
+# can match results up with its own records. `headers` are sent with the request,
+# e.g. to make a conditional GET; a 304 response leaves the existing file in place
+# and is reported with `not_modified` set.
+
+DownloadJob = namedtuple("DownloadJob", ["key", "url", "filename", "headers"], defaults=[None])
+DownloadResult = namedtuple("DownloadResult", [
+    "key", "url", "filename", "ok", "size", "error",
+    "not_modified", "etag", "last_modified", "sha256"
+], defaults=[False, None, None, None])
+
+
+class DownloadsFailed(Exception):
+    """
+    Raised once a batch of downloads has finished if any of them failed, so that
+    whatever needed the files doesn't carry on as if it had them.
+    """
+
+
+class DownloadStats:
+    """
+    Running totals for a batch of downloads, used to report throughput so the
+    worker count can be tuned.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.finished = None
+        self.files = 0
+        self.failed = 0
+        self.not_modified = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def record(self, result):
+        with self._lock:
+            if result.not_modified:
+                self.not_modified += 1
+            elif result.ok:
+                self.files += 1
+                self.bytes += result.size
+            else:
+                self.failed += 1
+
+    def stop(self):
+        self.finished = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    def summary(self):
+        elapsed = max(self.elapsed, 1e-9)
+        return (f"{self.files} files ({self.bytes / 1_000_000:.1f} MB) downloaded, "
+                f"{self.not_modified} unchanged, {self.failed} failed in {elapsed:.1f}s - "
+                f"{self.files / elapsed:.2f} files/s, "
+                f"{self.bytes / 1_000_000 / elapsed:.2f} MB/s")
+
+
+def _download(job, fetch):
+    try:
+        response = fetch(job.url, headers=job.headers or {})
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if response.status_code == 304:
+            metrics.count("download.not_modified")
+            return DownloadResult(job.key, job.url, job.filename, True, 0, None,
+                                  True, etag, last_modified)
+
+        content = response.content
+        filesystem.write_atomically(job.filename, content)
+        metrics.count("download.files")
+        metrics.count("download.bytes", len(content))
+        return DownloadResult(job.key, job.url, job.filename, True, len(content), None,
+                              False, etag, last_modified, hashlib.sha256(content).hexdigest())
+    except Exception as e:
+        metrics.count("download.failed")
+        return DownloadResult(job.key, job.url, job.filename, False, 0, e)
+
+
+def download_all(jobs, fetch, workers=DEFAULT_DOWNLOAD_WORKERS, stats=None):
+    """
+    Downloads each DownloadJob using `fetch(url, headers=...)` on a pool of worker threads,
+    yielding a DownloadResult for each one as it completes. Only a bounded number
+    of jobs are in flight at once, so `jobs` may be a lazy iterable.
+
+    Results are yielded on the calling thread, so the caller can safely write
+    them to a database connection that is not shared with the workers.
+
+    :param jobs: iterable of DownloadJob
+    :param fetch: callable taking a URL and `headers`, returning a requests.Response
+    :param workers: number of concurrent downloads
+    :param stats: optional DownloadStats to record throughput into
+    """
+    workers = max(1, int(workers))
+    max_in_flight = workers * 2
+    jobs = iter(jobs)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        in_flight = set()
+        exhausted = False
+        while True:
+            while not exhausted and len(in_flight) < max_in_flight:
+                job = next(jobs, None)
+                if job is None:
+                    exhausted = True
+                    break
+                in_flight.add(executor.submit(_download, job, fetch))
+
+            if not in_flight:
+                break
+
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                if stats is not None:
+                    stats.record(result)
+                yield result
+
+    if stats is not None:
+        stats.stop()
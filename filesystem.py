@@ -0,0 +1,132 @@
+import fcntl
+import hashlib
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+##
+# Helpers for putting files in place without copying their contents where the
+# filesystem lets us share them instead, for writing them atomically, and for
+# checksumming them.
+
+# From linux/fs.h - clones a file's extents (a "reflink") on filesystems that
+# support copy-on-write, such as btrfs and XFS
+FICLONE = 0x40049409
+
+
+def _umask():
+    # The umask can only be read by setting it, so this is done once, on import,
+    # before any other threads are started
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+# The mode open() gives new files. tempfile.mkstemp creates files only their
+# owner can read, which would stop anyone else reading the assets we publish
+DEFAULT_FILE_MODE = 0o666 & ~_umask()
+
+
+def link_or_copy(source, dest):
+    """
+    Creates dest as a hardlink to source, falling back to a reflink and then a
+    plain copy where that isn't possible (e.g. across filesystems). dest must
+    not already exist. Returns which of "hardlink", "reflink" or "copy" was used.
+    """
+    try:
+        os.link(source, dest)
+        return "hardlink"
+    except OSError:
+        pass
+
+    try:
+        _reflink(source, dest)
+        return "reflink"
+    except OSError:
+        if os.path.exists(dest):
+            os.unlink(dest)
+
+    shutil.copyfile(source, dest)
+    return "copy"
+
+
+def _reflink(source, dest):
+    with open(source, "rb") as src, open(dest, "xb") as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+def replace_with_link(source, dest):
+    """
+    Like link_or_copy, but replaces dest if it exists, without there ever being
+    a moment when dest is missing or incomplete.
+    """
+    directory = os.path.dirname(dest) or "."
+    temp_path = os.path.join(directory, f".{os.path.basename(dest)}.{os.getpid()}.part")
+    if os.path.exists(temp_path):
+        os.unlink(temp_path)
+    try:
+        method = link_or_copy(source, temp_path)
+        os.replace(temp_path, dest)
+        return method
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+
+@contextmanager
+def _replacing(path):
+    # Yields a temporary file next to path to be written, which is renamed over
+    # path once the block finishes, or removed if it fails
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".", suffix=".part")
+    os.close(fd)
+    try:
+        yield temp_path
+        os.chmod(temp_path, DEFAULT_FILE_MODE)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def write_atomically(path, content):
+    """
+    Writes content to a temporary file next to path and renames it into place,
+    so an interrupted run never leaves a partially written file behind that a
+    later run would mistake for a complete one.
+
+    :param content: bytes, or an iterable of byte chunks to be written in turn
+    """
+    if isinstance(content, bytes):
+        content = [content]
+    with _replacing(path) as temp_path, open(temp_path, "wb") as f:
+        for chunk in content:
+            f.write(chunk)
+
+
+def copy_atomically(source, dest):
+    """
+    Copies source to dest the way write_atomically writes it, replacing dest if
+    it exists.
+    """
+    with _replacing(dest) as temp_path:
+        shutil.copyfile(source, temp_path)
+
+
+def break_link(path):
+    """
+    Gives path its own copy of its contents if it shares them with another file
+    through a hardlink, so it can be modified in place without changing the
+    other file.
+    """
+    if os.stat(path).st_nlink >= 2:
+        copy_atomically(path, path)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -4,6 +4,8 @@ import urllib.request
 import shutil
 import sqlite3
 
+from normalisation import normalise
+
 def fetch_database(filename):
     r = urllib.request.urlopen('https://nzsl-assets.vuw.ac.nz/dnzsl/freelex/publicsearch?xmldump=1')
     with open(filename, "wb") as f:
@@ -92,13 +94,3 @@ def copy_images_to_one_folder():
         shutil.rmtree("assets")
     os.makedirs("assets")
     os.system("cp picture/*/*.png assets/ 2>/dev/null")
-
-# Helper functions
-def normalise(s):
-    return (s.lower()
-             .replace("ā", "a")
-             .replace("ē", "e")
-             .replace("é", "e")
-             .replace("ī", "i")
-             .replace("ō", "o")
-             .replace("ū", "u"))
@@ -0,0 +1,141 @@
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ChunkedEncodingError, ConnectionError, HTTPError, Timeout
+from urllib3.exceptions import ProtocolError
+
+import log
+import metrics
+
+logger = log.get_logger(__name__)
+
+DEFAULT_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 16))
+MAX_ATTEMPTS = int(os.getenv("HTTP_MAX_ATTEMPTS", 5))
+BACKOFF_FACTOR = 1
+RETRY_STATUSES = [502, 503, 504]
+
+##
+# Sessions are created once and reused for the whole run, so that connections
+# (and their TLS handshakes) are kept alive between requests. requests.Session is
+# shared between the download worker threads; the underlying urllib3 connection
+# pools are thread safe, and we never mutate the session after it is set up
+# except while holding _lock.
+
+_lock = threading.RLock()
+_shared_session = None
+_authenticated_sessions = {}
+_mounted_pools = set()
+
+
+def new_session(pool_size=DEFAULT_POOL_SIZE):
+    session = requests.Session()
+    _mount(session, "https://", pool_size)
+    _mount(session, "http://", pool_size)
+    return session
+
+
+def _mount(session, prefix, pool_size):
+    # Every retry is made by get() below, so that a request is tried at most
+    # `attempts` times in all, rather than retried by urllib3 inside each of them
+    session.mount(prefix, HTTPAdapter(max_retries=0,
+                                      pool_connections=pool_size,
+                                      pool_maxsize=pool_size))
+
+
+def shared_session():
+    """
+    Returns the unauthenticated session used for fetching assets from S3.
+    """
+    global _shared_session
+    with _lock:
+        if _shared_session is None:
+            _shared_session = new_session()
+        return _shared_session
+
+
+def size_pool_for(url, pool_size, session=None):
+    """
+    Makes sure requests to the host of `url` can keep at least `pool_size`
+    connections open, e.g. one per download worker. Hosts keep the default pool
+    size unless this is called for them.
+    """
+    session = session or shared_session()
+    parts = urlsplit(url)
+    if not parts.scheme or not parts.netloc:
+        return
+    prefix = f"{parts.scheme}://{parts.netloc}/"
+    with _lock:
+        if (id(session), prefix, pool_size) in _mounted_pools:
+            return
+        _mount(session, prefix, pool_size)
+        _mounted_pools.add((id(session), prefix, pool_size))
+
+
+def get(url, session=None, attempts=MAX_ATTEMPTS, **kwargs):
+    """
+    Makes a GET request, retrying with exponential backoff on a 502, 503 or 504
+    response, or if the connection fails or is broken part way through. After
+    `attempts` tries, returns the last response or re-raises the last error.
+
+    :param url:
+    :param session: defaults to the shared session
+    :param attempts: the maximum number of times to try the request
+    :return: requests.Response
+    """
+    session = session or shared_session()
+    for attempt in range(1, attempts + 1):
+        # A connection broken while the body is being read surfaces as a
+        # ProtocolError or ChunkedEncodingError rather than a ConnectionError
+        try:
+            response = session.get(url, **kwargs)
+        except (ProtocolError, ChunkedEncodingError, ConnectionError, Timeout):
+            if attempt == attempts:
+                raise
+            reason = "a connection error"
+        else:
+            metrics.count("http.requests")
+            metrics.observe("http.latency_seconds", response.elapsed.total_seconds())
+            if response.status_code not in RETRY_STATUSES or attempt == attempts:
+                return response
+            response.close()
+            reason = f"a {response.status_code} response"
+        metrics.count("http.retries")
+        logger.warning(f"Retrying {url} after {reason}, attempt {attempt} of {attempts}")
+        time.sleep(BACKOFF_FACTOR * 2 ** attempt)
+
+
+def authenticated_session(name, login, refresh=False):
+    """
+    Returns a cached session identified by `name`, calling `login(session)` to
+    authenticate it the first time it is requested, or again if `refresh` is set.
+    """
+    with _lock:
+        session = _authenticated_sessions.get(name)
+        if session is None or refresh:
+            session = new_session()
+            login(session)
+            _authenticated_sessions[name] = session
+        return session
+
+
+def authenticated_get(name, login, is_expired, url, **kwargs):
+    """
+    Makes a GET request with the authenticated session `name`. If
+    `is_expired(response)` says the session has been logged out, logs in again
+    and repeats the request once, raising HTTPError if it is still logged out.
+    """
+    response = get(url, session=authenticated_session(name, login), **kwargs)
+    if is_expired(response):
+        logger.info(f"Session {name} expired, logging in again")
+        response.close()
+        response = get(url, session=authenticated_session(name, login, refresh=True), **kwargs)
+        # e.g. the login page itself, which mustn't be mistaken for what was asked for
+        if is_expired(response):
+            response.close()
+            raise HTTPError(f"Logging in to {name} failed: still logged out after logging in again for {url}",
+                            response=response)
+    return response
@@ -0,0 +1,90 @@
+import hashlib
+import os
+
+import filesystem
+
+##
+# A cache of processed images, keyed by the content of the source PNG and the
+# processing settings, so that pictures that haven't changed since the last build
+# are linked into place rather than processed again. Each entry holds the
+# finished image and its search thumbnail:
+#
+#   <cache>/<key[:2]>/<key>.png
+#   <cache>/<key[:2]>/<key>.thumb.png
+#
+# Entries are touched whenever they are used, and the least recently used are
+# evicted once the cache grows past its size limit.
+
+DEFAULT_IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", ".image-cache")
+DEFAULT_IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+
+
+def cache_key(source_path, settings):
+    """
+    :param source_path: the unprocessed image
+    :param settings: a string identifying the processing applied, which must
+                     change whenever the output would
+    """
+    digest = hashlib.sha256(settings.encode())
+    with open(source_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _entry_paths(cache_dir, key):
+    folder = os.path.join(cache_dir, key[:2])
+    return os.path.join(folder, f"{key}.png"), os.path.join(folder, f"{key}.thumb.png")
+
+
+def restore(cache_dir, key, image_path, thumbnail_path):
+    """
+    Puts the cached outputs for `key` at image_path and thumbnail_path, returning
+    False if there is no complete entry for it.
+    """
+    cached_image, cached_thumbnail = _entry_paths(cache_dir, key)
+    if not (os.path.exists(cached_image) and os.path.exists(cached_thumbnail)):
+        return False
+    try:
+        filesystem.replace_with_link(cached_thumbnail, thumbnail_path)
+        filesystem.replace_with_link(cached_image, image_path)
+    except FileNotFoundError:
+        # Evicted by another process between the check and the link
+        return False
+    for path in (cached_image, cached_thumbnail):
+        os.utime(path)
+    return True
+
+
+def store(cache_dir, key, image_path, thumbnail_path):
+    cached_image, cached_thumbnail = _entry_paths(cache_dir, key)
+    os.makedirs(os.path.dirname(cached_image), exist_ok=True)
+    # The thumbnail goes in first, as an entry only counts once the image exists
+    filesystem.copy_atomically(thumbnail_path, cached_thumbnail)
+    filesystem.copy_atomically(image_path, cached_image)
+
+
+def evict(cache_dir, max_bytes=DEFAULT_IMAGE_CACHE_MAX_BYTES):
+    """
+    Deletes the least recently used files until the cache is under max_bytes.
+    Returns the number of bytes freed.
+    """
+    if not os.path.isdir(cache_dir):
+        return 0
+    files = []
+    for shard in os.scandir(cache_dir):
+        if not shard.is_dir():
+            continue
+        for entry in os.scandir(shard.path):
+            if entry.is_file():
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in files)
+    freed = 0
+    for _, size, path in sorted(files):
+        if total - freed <= max_bytes:
+            break
+        os.unlink(path)
+        freed += size
+    return freed
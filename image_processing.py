@@ -1,43 +1,543 @@
+import hashlib
+import json
+import multiprocessing
 import os
-from shlex import quote
+import shutil
+import subprocess
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import contextmanager
+from optparse import OptionParser
+from shlex import join
 
+import filesystem
+import image_cache
+import log
+import metrics
 from log import print_run_msg
 
+logger = log.get_logger(__name__)
 
-def generate_thumbnail(filename):
+DEFAULT_IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", os.cpu_count() or 1))
+DEFAULT_IMAGE_ENGINE = os.getenv("IMAGE_ENGINE", "imagemagick")
+PICTURES_FOLDER = "assets"
+THUMBNAIL_PREFIX = "50."
+THUMBNAIL_HEIGHT = 92
+MAX_IMAGE_SIZE = 600
+IMAGE_COLOURS = 4
+
+# Bump this whenever a change to the processing would change its output, so that
+# images cached by earlier builds are not reused
+PROCESSING_VERSION = 1
+
+##
+# The outcome of processing one image: how long each stage took, and the error
+# that stopped it if it failed part way through. tool_timings lists each
+# external command that was run, and how long it took.
+
+ImageResult = namedtuple("ImageResult", ["filename", "ok", "timings", "error", "cached", "tool_timings"],
+                         defaults=[False, ()])
+
+# (command, seconds) for each command run_cmd has run for the current image
+_tool_timings = []
+
+
+def run_cmd(args):
+        print_run_msg(join(args))
+        started = time.perf_counter()
+        try:
+                subprocess.run(args, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        finally:
+                _tool_timings.append((args[0], time.perf_counter() - started))
+
+
+def generate_thumbnail(filename, folder=PICTURES_FOLDER):
+        path = os.path.join(folder, filename)
         # Create thumbnails used on search screens
         # Some images have a 1px border that looks bad in search results
         # Not all do - but we can safely trim 1px off all images
-        shave_cmd = "mogrify -shave 1x1 assets/" + quote(filename)
-        print_run_msg(shave_cmd)
-        os.system(shave_cmd)
+        run_cmd(["mogrify", "-shave", "1x1", path])
 
         # Then we make thumbnails of the border-free images
-        create_thumbnail_cmd = "convert -resize x92 assets/" + \
-            quote(filename) + " assets/50." + quote(filename)
-        print_run_msg(create_thumbnail_cmd)
-        os.system(create_thumbnail_cmd)
+        run_cmd(["convert", "-resize", "x92", path, os.path.join(folder, THUMBNAIL_PREFIX + filename)])
 
-def resize_image(filename):
+def resize_image(filename, folder=PICTURES_FOLDER):
         # Resize images larger than 600x600 down using mogrify from imagemagick
-        cmd = "mogrify -resize '600x600>' assets/" + quote(filename)
-        print_run_msg(cmd)
-        os.system(cmd)
-
-def reduce_colour_depth(filename):
-        recolor_cmd = "convert -colors 4 assets/" + quote(filename) + " assets/" + quote(filename)
-        print_run_msg(recolor_cmd)
-        os.system(recolor_cmd)
-
-def optimise_image(filename):
-        optipng_cmd = "optipng -quiet assets/" + quote(filename)
-        print_run_msg(optipng_cmd)
-        os.system(optipng_cmd)
-
-def process_images(pictures_folder):
-        for path, dirs, files in os.walk(pictures_folder):
-                for filename in files:
-                        generate_thumbnail(filename)
-                        resize_image(filename)
-                        reduce_colour_depth(filename)
-                        optimise_image(filename)
+        run_cmd(["mogrify", "-resize", "600x600>", os.path.join(folder, filename)])
+
+def reduce_colour_depth(filename, folder=PICTURES_FOLDER):
+        path = os.path.join(folder, filename)
+        run_cmd(["convert", "-colors", "4", path, path])
+
+def optimise_image(filename, folder=PICTURES_FOLDER):
+        run_cmd(["optipng", "-quiet", os.path.join(folder, filename)])
+
+STAGES = [
+        ("thumbnail", generate_thumbnail),
+        ("resize", resize_image),
+        ("reduce colours", reduce_colour_depth),
+        ("optimise", optimise_image),
+]
+
+# The commands STAGES runs
+IMAGEMAGICK_COMMANDS = ["mogrify", "convert", "optipng"]
+
+##
+# In-process alternative to the ImageMagick/optipng commands above. The image is
+# decoded once, shaved, thumbnailed, resized and reduced to a 4 colour palette
+# in memory, and both outputs are written with an optimised PNG encoding. It
+# needs Pillow, which is only imported when this engine is used.
+#
+# Experimental: its output hasn't yet been checked against ImageMagick's on the
+# real assets with benchmarks/image_engine_parity.py, so it is never the
+# default and shouldn't be used for release builds until it has been.
+
+def process_image_in_memory(filename, folder=PICTURES_FOLDER, timings=None):
+        from PIL import Image
+
+        timings = {} if timings is None else timings
+        path = os.path.join(folder, filename)
+
+        with timed(timings, "decode"):
+                with Image.open(path) as source:
+                        image = source.convert("RGBA" if _has_transparency(source) else "RGB")
+
+        with timed(timings, "transform"):
+                # Nothing would be left after the shave to scale to the thumbnail height
+                if image.width <= 2 or image.height <= 2:
+                        raise ValueError(f"{image.width}x{image.height} is too small to process")
+
+                # Same 1px border trim as `mogrify -shave 1x1`
+                image = image.crop((1, 1, image.width - 1, image.height - 1))
+
+                # Same as `convert -resize x92`: scale to the thumbnail height, up or down
+                thumbnail_width = max(1, round(image.width * THUMBNAIL_HEIGHT / image.height))
+                thumbnail = image.resize((thumbnail_width, THUMBNAIL_HEIGHT), Image.Resampling.LANCZOS)
+
+                # Same as `mogrify -resize '600x600>'`: only ever shrink, keeping the aspect ratio
+                image.thumbnail((MAX_IMAGE_SIZE, MAX_IMAGE_SIZE), Image.Resampling.LANCZOS)
+
+                # Same as `convert -colors 4`
+                method = Image.Quantize.FASTOCTREE if image.mode == "RGBA" else Image.Quantize.MEDIANCUT
+                image = image.quantize(colors=IMAGE_COLOURS, method=method)
+
+        with timed(timings, "encode"):
+                thumbnail.save(os.path.join(folder, THUMBNAIL_PREFIX + filename), format="PNG", optimize=True)
+                image.save(path, format="PNG", optimize=True)
+
+def _has_transparency(image):
+        return image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+
+def _process_image_with_commands(filename, folder, timings):
+        for name, stage in STAGES:
+                with timed(timings, name):
+                        stage(filename, folder)
+
+@contextmanager
+def timed(timings, name):
+        # The stage is recorded as soon as it starts, so the last entry in
+        # timings is always the stage that was running if an error is raised
+        timings[name] = 0.0
+        started = time.perf_counter()
+        try:
+                yield
+        finally:
+                timings[name] = time.perf_counter() - started
+
+ENGINES = {
+        "imagemagick": _process_image_with_commands,
+        "pillow": process_image_in_memory,
+}
+
+def cache_settings(engine):
+        return f"{PROCESSING_VERSION}:{engine}:{THUMBNAIL_HEIGHT}:{MAX_IMAGE_SIZE}:{IMAGE_COLOURS}"
+
+def process_image(filename, folder=PICTURES_FOLDER, engine=DEFAULT_IMAGE_ENGINE, cache_dir=None):
+        """
+        Runs every stage for a single image, timing each one. A failing stage
+        stops this image but is reported rather than raised, so that one bad
+        image does not abort the rest of the batch.
+
+        With a cache_dir, an image that has been processed before with the same
+        settings is restored from the cache instead.
+        """
+        timings = {}
+        _tool_timings.clear()
+        path = os.path.join(folder, filename)
+        thumbnail_path = os.path.join(folder, THUMBNAIL_PREFIX + filename)
+        try:
+                if cache_dir:
+                        with timed(timings, "cache lookup"):
+                                key = image_cache.cache_key(path, cache_settings(engine))
+                                if image_cache.restore(cache_dir, key, path, thumbnail_path):
+                                        return ImageResult(filename, True, timings, None, True, tuple(_tool_timings))
+
+                # The image may be hardlinked to the downloaded original or, like
+                # its thumbnail, to an entry in the image cache, any of which the
+                # processing tools would otherwise overwrite in place. The
+                # thumbnail is made again from scratch, so it can just go.
+                filesystem.break_link(path)
+                if os.path.lexists(thumbnail_path):
+                        os.unlink(thumbnail_path)
+                ENGINES[engine](filename, folder, timings)
+
+                if cache_dir:
+                        with timed(timings, "cache store"):
+                                image_cache.store(cache_dir, key, path, thumbnail_path)
+        # Anything that goes wrong with one image, e.g. a file Pillow can't
+        # identify or that is too large to decode safely, fails only that image
+        except Exception as e:
+                stderr = getattr(e, "stderr", None)
+                stage = list(timings)[-1] if timings else "decode"
+                message = f"{stage} failed: {e}" + (f" ({stderr.decode(errors='replace').strip()})" if stderr else "")
+                return ImageResult(filename, False, timings, message, False, tuple(_tool_timings))
+        return ImageResult(filename, True, timings, None, False, tuple(_tool_timings))
+
+def images_to_process(pictures_folder):
+        # Thumbnails are written alongside the images they are made from, so skip
+        # any left over from an earlier run, and the sync manifest and other
+        # hidden files kept in the folder
+        return sorted(entry.name for entry in os.scandir(pictures_folder)
+                      if entry.is_file() and not entry.name.startswith((THUMBNAIL_PREFIX, ".")))
+
+def _check_engine(engine):
+        if engine not in ENGINES:
+                raise ValueError(f"Unknown image engine {engine!r}, expected one of {', '.join(ENGINES)}")
+        # Fail up front, rather than once per image, if the engine can't run here
+        if engine == "pillow":
+                import PIL  # noqa: F401
+                logger.warning("The pillow image engine is experimental; use imagemagick for release builds")
+        else:
+                missing = [command for command in IMAGEMAGICK_COMMANDS if shutil.which(command) is None]
+                if missing:
+                        raise FileNotFoundError(f"The {engine} image engine needs {', '.join(missing)}, "
+                                                f"which can't be found on the PATH")
+
+class ImageBatchReport:
+        """
+        Collects the results of processing a batch of images, reporting progress
+        as they come in and a summary with the time spent in each stage once
+        the batch is done.
+        """
+
+        def __init__(self, engine, workers, total=None):
+                self.engine = engine
+                self.workers = workers
+                self.progress = log.Progress(logger, "Processing images", total=total, unit="images")
+                self.started = time.perf_counter()
+                self.stage_totals = {}
+                self.processed = 0
+                self.cached = 0
+                self.failures = []
+
+        def record(self, result):
+                self.processed += 1
+                self.progress.update()
+                for name, seconds in result.timings.items():
+                        self.stage_totals[name] = self.stage_totals.get(name, 0.0) + seconds
+                        metrics.observe(f"image.{name.replace(' ', '_')}_seconds", seconds)
+                for tool, seconds in result.tool_timings:
+                        metrics.observe(f"image_tool.{tool}_seconds", seconds)
+                if result.cached:
+                        self.cached += 1
+                if not result.ok:
+                        logger.warning(f"Failed to process {result.filename}: {result.error}",
+                                       extra={"fields": {"image": result.filename}})
+                        self.failures.append(result)
+
+        def finish(self, cache_dir=None, cache_max_bytes=image_cache.DEFAULT_IMAGE_CACHE_MAX_BYTES):
+                elapsed = time.perf_counter() - self.started
+                metrics.count("image.processed", self.processed)
+                metrics.count("image.cached", self.cached)
+                metrics.count("image.failed", len(self.failures))
+                logger.info(f"Processed {self.processed - len(self.failures)} of {self.processed} images "
+                            f"with {self.engine} using {self.workers} workers in {elapsed:.1f}s")
+                if cache_dir:
+                        freed = image_cache.evict(cache_dir, cache_max_bytes)
+                        logger.info(f"  {self.cached} restored from the image cache, {freed / 1_000_000:.1f} MB evicted")
+                for name, seconds in self.stage_totals.items():
+                        logger.info(f"  {name}: {seconds:.1f}s total")
+                return self.failures
+
+def process_images(pictures_folder, workers=DEFAULT_IMAGE_WORKERS, engine=DEFAULT_IMAGE_ENGINE,
+                   cache_dir=None, cache_max_bytes=image_cache.DEFAULT_IMAGE_CACHE_MAX_BYTES, filenames=None):
+        """
+        Processes every image in pictures_folder (or just `filenames`) with the
+        given engine ("imagemagick" or "pillow"), spreading the images across
+        `workers` processes. Logs the time spent in each stage and returns the
+        list of images that failed.
+
+        If a cache_dir is given, unchanged images are restored from it rather
+        than processed, newly processed ones are added, and the cache is then
+        trimmed to cache_max_bytes.
+        """
+        _check_engine(engine)
+        filenames = images_to_process(pictures_folder) if filenames is None else filenames
+        workers = max(1, int(workers))
+        report = ImageBatchReport(engine, workers, total=len(filenames))
+
+        # Forked, as the default start method on newer Pythons imports the main
+        # module again in each worker, and the build scripts aren't written to be
+        # imported
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork")) as executor:
+                for result in executor.map(process_image, filenames, [pictures_folder] * len(filenames),
+                                           [engine] * len(filenames), [cache_dir] * len(filenames),
+                                           chunksize=16):
+                        report.record(result)
+        return report.finish(cache_dir, cache_max_bytes)
+
+class ImageQueue:
+        """
+        Processes images into pictures_folder as they are added, rather than
+        waiting for a whole folder to be ready, e.g. while the rest are still
+        being downloaded. Each image is linked into pictures_folder from where it
+        was downloaded, and processed on a pool of worker processes.
+
+        At most max_queued images are waiting or being processed at once; add()
+        blocks until there is room, which in turn holds back the downloads
+        feeding it.
+
+            queue = ImageQueue("assets")
+            queue.add("signbank-assets/hello.png")
+            failures = queue.finish()
+        """
+
+        def __init__(self, pictures_folder, workers=DEFAULT_IMAGE_WORKERS, engine=DEFAULT_IMAGE_ENGINE,
+                     cache_dir=None, cache_max_bytes=image_cache.DEFAULT_IMAGE_CACHE_MAX_BYTES, max_queued=None):
+                _check_engine(engine)
+                self.pictures_folder = pictures_folder
+                self.workers = max(1, int(workers))
+                self.engine = engine
+                self.cache_dir = cache_dir
+                self.cache_max_bytes = cache_max_bytes
+                self.max_queued = max_queued or self.workers * 4
+                self.report = ImageBatchReport(engine, self.workers)
+                self.in_flight = set()
+                self.added = set()
+
+                if os.path.isdir(pictures_folder):
+                        shutil.rmtree(pictures_folder)
+                os.makedirs(pictures_folder)
+                # The workers are all forked now, before whatever is adding images
+                # starts any threads of its own (e.g. to download them), as forking
+                # a process with other threads running isn't safe
+                self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                    mp_context=multiprocessing.get_context("fork"))
+                self.executor.submit(os.getpid).result()
+
+        def add(self, source_path):
+                filename = os.path.basename(source_path)
+                # An image shared between several signs only needs processing once
+                if filename in self.added:
+                        return
+                self.added.add(filename)
+                filesystem.replace_with_link(source_path, os.path.join(self.pictures_folder, filename))
+                while len(self.in_flight) >= self.max_queued:
+                        self._collect(FIRST_COMPLETED)
+                self.in_flight.add(self.executor.submit(process_image, filename, self.pictures_folder,
+                                                        self.engine, self.cache_dir))
+
+        def _collect(self, return_when):
+                done, self.in_flight = wait(self.in_flight, return_when=return_when)
+                for future in done:
+                        self.report.record(future.result())
+
+        def finish(self):
+                """
+                Waits for every image to be processed, logs a summary and
+                returns the list of images that failed.
+                """
+                self._collect(ALL_COMPLETED)
+                self.executor.shutdown()
+                return self.report.finish(self.cache_dir, self.cache_max_bytes)
+
+##
+# Sharding, so that the images can be processed on several machines at once.
+# Each image belongs to one of N shards by a hash of its name, so every runner
+# given the same folder of images agrees on which are its own:
+#
+#   python3 image_processing.py process assets --shard 1/4 --output shard-1
+#   (and 2/4, 3/4 and 4/4 on other runners, then with all their output)
+#   python3 image_processing.py merge shard-1 shard-2 shard-3 shard-4 --into assets
+#
+# Each runner links the images and thumbnails it has processed into its output
+# folder, and writes SHARD_MANIFEST there last, listing them with their SHA-256
+# and any images that failed, which are left out. merge only assembles the
+# images once every shard of the same set of images, processed with the same
+# settings, is there and intact, with no failures.
+
+SHARD_MANIFEST = "shard-manifest.json"
+
+def parse_shard(value):
+        """
+        The (index, count) of a shard given as "i/N", counting from 1.
+        """
+        try:
+                index, count = (int(n) for n in value.split("/"))
+        except ValueError:
+                raise ValueError(f"Expected a shard as i/N, e.g. 1/4, not {value!r}")
+        if not 1 <= index <= count:
+                raise ValueError(f"Shard {value} is out of range, expected 1/{count} to {count}/{count}")
+        return index, count
+
+def shard_of(filename, shards):
+        """
+        The shard, counting from 1, that an image belongs to. The same on every
+        machine and Python version, unlike hash().
+        """
+        digest = hashlib.sha256(filename.encode()).digest()
+        return int.from_bytes(digest[:8], "big") % shards + 1
+
+def _images_sha256(filenames):
+        # Identifies the set of images being sharded, so shards cut from
+        # different sets can't be merged
+        return hashlib.sha256("\n".join(sorted(filenames)).encode()).hexdigest()
+
+def process_shard(pictures_folder, output_folder, shard, shards, workers=DEFAULT_IMAGE_WORKERS,
+                  engine=DEFAULT_IMAGE_ENGINE, cache_dir=None,
+                  cache_max_bytes=image_cache.DEFAULT_IMAGE_CACHE_MAX_BYTES):
+        """
+        Processes the images in pictures_folder that belong to shard `shard` of
+        `shards`, and links them and their thumbnails into output_folder with a
+        manifest. Images that fail are listed in the manifest but not linked,
+        so a shard with failures can't be merged. Returns the list of images
+        that failed.
+        """
+        filenames = images_to_process(pictures_folder)
+        own = [filename for filename in filenames if shard_of(filename, shards) == shard]
+        logger.info(f"Shard {shard}/{shards}: {len(own)} of {len(filenames)} images")
+        failures = process_images(pictures_folder, workers, engine, cache_dir, cache_max_bytes, filenames=own)
+
+        if os.path.isdir(output_folder):
+                shutil.rmtree(output_folder)
+        os.makedirs(output_folder)
+        failed = [failure.filename for failure in failures]
+        outputs = {}
+        for filename in sorted(set(own) - set(failed)):
+                for name in (filename, THUMBNAIL_PREFIX + filename):
+                        path = os.path.join(pictures_folder, name)
+                        if os.path.exists(path):
+                                filesystem.link_or_copy(path, os.path.join(output_folder, name))
+                                outputs[name] = filesystem.file_sha256(path)
+
+        manifest = {
+                "shard": shard,
+                "shards": shards,
+                "settings": cache_settings(engine),
+                "images": _images_sha256(filenames),
+                "total": len(filenames),
+                "sources": own,
+                "outputs": outputs,
+                "failed": failed,
+        }
+        # Written last, so its presence means the shard is complete
+        manifest_filename = os.path.join(output_folder, SHARD_MANIFEST)
+        with open(manifest_filename + ".part", "w") as f:
+                json.dump(manifest, f, indent=2)
+        os.replace(manifest_filename + ".part", manifest_filename)
+        return failures
+
+def check_shards(shard_folders):
+        """
+        Reads the manifest of each shard's output folder, and checks they are
+        every shard of the same images, each with all of its output intact and
+        no images that failed.
+        Returns the manifests and a list of the problems found.
+        """
+        manifests = {}
+        problems = []
+        for folder in shard_folders:
+                manifest_filename = os.path.join(folder, SHARD_MANIFEST)
+                if not os.path.exists(manifest_filename):
+                        problems.append(f"{folder}: no {SHARD_MANIFEST}, so its shard didn't finish")
+                        continue
+                with open(manifest_filename) as f:
+                        manifests[folder] = json.load(f)
+        if not manifests:
+                return manifests, problems or ["no shards given"]
+
+        first_folder, first = next(iter(manifests.items()))
+        shards_seen = {}
+        for folder, manifest in manifests.items():
+                for key in ("shards", "images", "settings"):
+                        if manifest[key] != first[key]:
+                                problems.append(f"{folder}: {key} {manifest[key]!r} doesn't match "
+                                                f"{first[key]!r} in {first_folder}")
+                if manifest["shard"] in shards_seen:
+                        problems.append(f"{folder}: shard {manifest['shard']} is also in {shards_seen[manifest['shard']]}")
+                shards_seen[manifest["shard"]] = folder
+                for filename in manifest["failed"]:
+                        problems.append(f"{folder}: {filename} failed to process")
+                for name, sha256 in manifest["outputs"].items():
+                        path = os.path.join(folder, name)
+                        if not os.path.exists(path):
+                                problems.append(f"{folder}: {name} is missing")
+                        elif filesystem.file_sha256(path) != sha256:
+                                problems.append(f"{folder}: {name} has changed since the shard finished")
+
+        shards = first["shards"]
+        missing = [f"{shard}/{shards}" for shard in range(1, shards + 1) if shard not in shards_seen]
+        if missing:
+                problems.append(f"missing shard{'s' if len(missing) > 1 else ''} {', '.join(missing)}")
+        sources = sum(len(manifest["sources"]) for manifest in manifests.values())
+        if not missing and sources != first["total"]:
+                problems.append(f"the shards hold {sources} images, but there are {first['total']}")
+        return manifests, problems
+
+def merge_shards(shard_folders, pictures_folder):
+        """
+        Recreates pictures_folder from the output of every shard, if
+        check_shards finds no problems with them. Returns the problems found.
+        """
+        manifests, problems = check_shards(shard_folders)
+        if problems:
+                return problems
+
+        if os.path.isdir(pictures_folder):
+                shutil.rmtree(pictures_folder)
+        os.makedirs(pictures_folder)
+        images = 0
+        for folder, manifest in manifests.items():
+                for name in manifest["outputs"]:
+                        filesystem.link_or_copy(os.path.join(folder, name), os.path.join(pictures_folder, name))
+                images += len(manifest["sources"])
+        logger.info(f"Merged {images} images from {len(manifests)} shards into {pictures_folder}")
+        return []
+
+if __name__ == "__main__":
+        parser = OptionParser(usage="%prog process FOLDER --shard i/N --output DIR\n"
+                                    "       %prog merge SHARD_DIR... --into FOLDER")
+        parser.add_option("--shard", dest="shard", help="The shard of the images to process, e.g. 1/4")
+        parser.add_option("--output", dest="output", help="Folder to write the shard's images and manifest to")
+        parser.add_option("--into", dest="into", default=PICTURES_FOLDER,
+                          help=f"Folder to merge the shards into (default {PICTURES_FOLDER})")
+        parser.add_option("--workers", type="int", dest="workers", default=DEFAULT_IMAGE_WORKERS)
+        parser.add_option("--engine", dest="engine", default=DEFAULT_IMAGE_ENGINE, choices=list(ENGINES),
+                          help="imagemagick (the default), or the experimental pillow engine")
+        parser.add_option("--image-cache", dest="image_cache", default=image_cache.DEFAULT_IMAGE_CACHE_DIR)
+        parser.add_option("--no-image-cache", action="store_true", dest="no_image_cache")
+        (options, args) = parser.parse_args()
+
+        log.configure()
+        if len(args) == 2 and args[0] == "process":
+                if not options.shard or not options.output:
+                        parser.error("process needs --shard and --output")
+                try:
+                        shard, shards = parse_shard(options.shard)
+                except ValueError as e:
+                        parser.error(str(e))
+                failures = process_shard(args[1], options.output, shard, shards, options.workers, options.engine,
+                                         None if options.no_image_cache else options.image_cache)
+                if failures:
+                        sys.exit(f"{len(failures)} images failed to process in shard {shard}/{shards}, "
+                                 "so it can't be merged")
+        elif len(args) >= 2 and args[0] == "merge":
+                problems = merge_shards(args[1:], options.into)
+                for problem in problems:
+                        logger.error(problem)
+                if problems:
+                        sys.exit(f"Not merging the shards into {options.into}: {len(problems)} problems found")
+        else:
+                parser.error("expected process or merge")
@@ -1,2 +1,123 @@
+import json
+import logging
+import os
+import sys
+import time
+
+##
+# Logging for the build. Modules log through get_logger(__name__) at the usual
+# levels: a line per step of the build at INFO, and per-row or per-file detail
+# at DEBUG, which is off by default. configure() sets the level and where the
+# output goes, either as plain text or as one JSON object per line for log
+# processing; extra structured fields can be attached to a record with
+# `extra={"fields": {...}}` and are included in the JSON.
+#
+# Loops over every asset or image should check logger.isEnabledFor(DEBUG)
+# once before the loop rather than formatting messages that won't be shown,
+# and report on how far they have got with a Progress.
+
+LEVELS = ["DEBUG", "INFO", "WARNING", "ERROR"]
+DEFAULT_LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+DEFAULT_LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+PROGRESS_INTERVAL = float(os.getenv("LOG_PROGRESS_INTERVAL", 10))
+
+_root = logging.getLogger("nzsl")
+
+
+def get_logger(name):
+    return _root.getChild(name)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        message = super().format(record)
+        if record.levelno >= logging.WARNING:
+            return f"{record.levelname}: {message}"
+        return message
+
+
+class JSONLinesFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S%z"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **getattr(record, "fields", {}),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure(level=DEFAULT_LOG_LEVEL, format=DEFAULT_LOG_FORMAT, stream=None):
+    """
+    Sends the build's log to `stream` (stdout by default), showing messages at
+    `level` and above, formatted as "text" or "json" (one object per line).
+    """
+    if format not in ("text", "json"):
+        raise ValueError(f"Unknown log format {format!r}, expected text or json")
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(JSONLinesFormatter() if format == "json" else TextFormatter())
+    _root.handlers[:] = [handler]
+    _root.setLevel(level.upper() if isinstance(level, str) else level)
+    _root.propagate = False
+
+
+class Progress:
+    """
+    Reports how far through a long loop we are at most once every `interval`
+    seconds, with the throughput so far and, if the total is known, an estimate
+    of the time remaining. update() is cheap enough to call on every iteration.
+
+        progress = Progress(logger, "Downloading images", total=len(jobs))
+        for job in jobs:
+            ...
+            progress.update()
+        progress.finish()
+    """
+
+    def __init__(self, logger, description, total=None, unit="items", interval=PROGRESS_INTERVAL):
+        self.logger = logger
+        self.description = description
+        self.total = total
+        self.unit = unit
+        self.interval = interval
+        self.count = 0
+        self.started = time.monotonic()
+        self._next_report = self.started + interval
+
+    def update(self, n=1):
+        self.count += n
+        if self._next_report is not None:
+            now = time.monotonic()
+            if now >= self._next_report:
+                self._next_report = now + self.interval
+                self._report(now)
+
+    def _report(self, now, finished=False):
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
+        elapsed = max(now - self.started, 1e-9)
+        rate = self.count / elapsed
+        message = f"{self.description}: {self.count}"
+        if self.total is not None:
+            message += f" of {self.total}"
+        message += f" {self.unit} in {elapsed:.0f}s ({rate:.1f}/s)"
+        if self.total is not None and not finished and rate > 0:
+            message += f", about {(self.total - self.count) / rate:.0f}s remaining"
+        self.logger.info(message, extra={"fields": {
+            "progress": self.description, "count": self.count, "total": self.total,
+            "elapsed_seconds": round(elapsed, 3), "per_second": round(rate, 3), "finished": finished,
+        }})
+
+    def finish(self):
+        self._next_report = None
+        self._report(time.monotonic(), finished=True)
+
+
+_commands = get_logger("commands")
+
+
 def print_run_msg(msg):
-    print(" - Running: " + msg)
+    _commands.debug(" - Running: %s", msg)
@@ -0,0 +1,182 @@
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import log
+
+##
+# Measurements collected over a whole build, so that we can see where the time
+# goes and compare one month's build with the next. Any module can record into
+# the process-wide registry:
+#
+#  - count(name, n): a running total, e.g. rows written or bytes fetched
+#  - observe(name, value): one sample of something measured many times, e.g. the
+#    latency of a request, reported as a count, total and percentiles
+#  - stage(name): the wall and CPU time of a stage of the build, optionally
+#    profiled with cProfile or tracemalloc
+#
+# The build writes everything out as JSON at the end, with a readable summary.
+# Metrics are per process; image processing workers send their timings back
+# with their results to be recorded here, and other child processes return
+# what they recorded with take() for their parent to merge().
+
+DEFAULT_METRICS_FILENAME = os.getenv("BUILD_METRICS_FILE", "build-metrics.json")
+DEFAULT_PROFILE_DIR = os.getenv("BUILD_PROFILE_DIR", "profiles")
+PROFILERS = ["cprofile", "tracemalloc"]
+
+logger = log.get_logger(__name__)
+
+_lock = threading.Lock()
+_started_at = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+_counters = {}
+_samples = {}
+_stages = {}
+
+
+def count(name, n=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def observe(name, value):
+    with _lock:
+        _samples.setdefault(name, []).append(value)
+
+
+def _cpu_seconds():
+    # Includes child processes once they have exited, such as the image tools
+    # and the image processing workers
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+@contextmanager
+def stage(name, profile=None, profile_dir=DEFAULT_PROFILE_DIR):
+    """
+    Records the wall and CPU time of the code run inside the block against
+    stage `name`.
+
+    :param profile: "cprofile" to save a profile of the stage (of the calling
+                    thread only) to <profile_dir>/<name>.prof, or "tracemalloc"
+                    to record its peak memory use and save the largest
+                    allocations to <profile_dir>/<name>.tracemalloc.txt
+    """
+    if profile is not None and profile not in PROFILERS:
+        raise ValueError(f"Unknown profiler {profile!r}, expected one of {', '.join(PROFILERS)}")
+    record = {}
+    profiler = None
+    if profile == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+    elif profile == "tracemalloc":
+        tracemalloc.start()
+
+    wall_started = time.perf_counter()
+    cpu_started = _cpu_seconds()
+    try:
+        yield record
+    finally:
+        record["wall_seconds"] = round(time.perf_counter() - wall_started, 3)
+        record["cpu_seconds"] = round(_cpu_seconds() - cpu_started, 3)
+        if profile is not None:
+            os.makedirs(profile_dir, exist_ok=True)
+        if profiler is not None:
+            profiler.disable()
+            record["profile"] = os.path.join(profile_dir, f"{name}.prof")
+            profiler.dump_stats(record["profile"])
+        elif profile == "tracemalloc":
+            record["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+            record["profile"] = os.path.join(profile_dir, f"{name}.tracemalloc.txt")
+            with open(record["profile"], "w") as f:
+                for statistic in tracemalloc.take_snapshot().statistics("lineno")[:50]:
+                    print(statistic, file=f)
+            tracemalloc.stop()
+        with _lock:
+            _stages[name] = record
+
+
+def take():
+    """
+    Removes and returns everything recorded so far in this process, e.g. to
+    send back from a child process to be merged into its parent's.
+    """
+    with _lock:
+        data = {"stages": dict(_stages), "counters": dict(_counters), "samples": dict(_samples)}
+        _stages.clear()
+        _counters.clear()
+        _samples.clear()
+    return data
+
+
+def merge(data):
+    """
+    Adds metrics returned by take() in another process to this process's.
+    """
+    with _lock:
+        _stages.update(data["stages"])
+        for name, n in data["counters"].items():
+            _counters[name] = _counters.get(name, 0) + n
+        for name, values in data["samples"].items():
+            _samples.setdefault(name, []).extend(values)
+
+
+def _percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def _summarise(values):
+    ordered = sorted(values)
+    return {
+        "count": len(ordered),
+        "total": round(sum(ordered), 6),
+        "p50": _percentile(ordered, 50),
+        "p90": _percentile(ordered, 90),
+        "p99": _percentile(ordered, 99),
+        "max": ordered[-1],
+    }
+
+
+def report(**info):
+    """
+    Everything recorded so far, as a dict ready to be written out as JSON, along
+    with any extra `info` about the build.
+    """
+    with _lock:
+        return {
+            "started_at": _started_at,
+            "finished_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "argv": sys.argv,
+            **info,
+            "stages": dict(_stages),
+            "counters": dict(sorted(_counters.items())),
+            "samples": {name: _summarise(values) for name, values in sorted(_samples.items())},
+        }
+
+
+def write_report(filename=DEFAULT_METRICS_FILENAME, **info):
+    data = report(**info)
+    temp_filename = filename + ".part"
+    with open(temp_filename, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(temp_filename, filename)
+    return data
+
+
+def print_summary(data):
+    logger.info("Build metrics:")
+    for name, record in data["stages"].items():
+        line = f"  {name}: {record['wall_seconds']:.1f}s wall, {record['cpu_seconds']:.1f}s CPU"
+        if "peak_memory_bytes" in record:
+            line += f", {record['peak_memory_bytes'] / 1_000_000:.1f} MB peak"
+        logger.info(line, extra={"fields": {"stage": name, **record}})
+    for name, value in data["counters"].items():
+        logger.info(f"  {name}: {value}", extra={"fields": {"counter": name, "value": value}})
+    for name, summary in data["samples"].items():
+        logger.info(f"  {name}: {summary['count']} samples, {summary['total']:.1f} total, "
+                    f"p50 {summary['p50']:.3f}, p99 {summary['p99']:.3f}, max {summary['max']:.3f}",
+                    extra={"fields": {"sample": name, **summary}})
@@ -0,0 +1,42 @@
+import re
+import unicodedata
+from functools import lru_cache
+
+##
+# Folds text to lowercase printable ASCII for searching, so that e.g. "Māori",
+# "MĀORI" and "maori" all normalise to "maori". Used for the `target` and
+# `*_normalized` columns and the full text search index.
+#
+# Accented letters are folded by decomposing them (NFKD) and dropping the
+# combining marks, which leaves everything other than plain ASCII to be
+# dropped by the ASCII encoder - all of which happens in C. The handful of letters
+# and punctuation that don't decompose are given an ASCII spelling first with a
+# translate table, and control characters become spaces. The last
+# NORMALISE_CACHE_SIZE results are memoised, as the same glosses and topic
+# names are normalised many times over; the limit stops a long-running
+# caller, such as a search service, from keeping every term it is given.
+
+NORMALISE_CACHE_SIZE = 65536
+
+_SPELLINGS = {
+    "ß": "ss", "ẞ": "ss", "æ": "ae", "Æ": "ae", "œ": "oe", "Œ": "oe", "ø": "o", "Ø": "o",
+    "ł": "l", "Ł": "l", "đ": "d", "Đ": "d", "ð": "d", "Ð": "d", "þ": "th", "Þ": "th",
+    "ı": "i", "ħ": "h", "Ħ": "h", "ŋ": "ng", "Ŋ": "ng",
+    "‘": "'", "’": "'", "‚": "'", "‛": "'", "“": '"', "”": '"', "„": '"', "‟": '"',
+    "‐": "-", "‑": "-", "‒": "-", "–": "-", "—": "-", "―": "-", "•": "*",
+}
+_SPELLING_TABLE = str.maketrans(_SPELLINGS)
+_NEEDS_SPELLING = re.compile("[" + re.escape("".join(_SPELLINGS)) + "]")
+
+_CONTROL_TABLE = str.maketrans({c: " " for c in [*map(chr, range(0x20)), "\x7f"]})
+
+
+@lru_cache(maxsize=NORMALISE_CACHE_SIZE)
+def normalise(s):
+    if not s.isascii():
+        if _NEEDS_SPELLING.search(s):
+            s = s.translate(_SPELLING_TABLE)
+        s = unicodedata.normalize("NFKD", s).encode("ascii", "ignore").decode("ascii")
+    if not s.isprintable():
+        s = s.translate(_CONTROL_TABLE)
+    return s.lower()
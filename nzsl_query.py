@@ -0,0 +1,135 @@
+#!/usr/bin/python
+import os
+import sqlite3
+import threading
+from functools import lru_cache
+from optparse import OptionParser
+from urllib.parse import quote
+
+from normalisation import normalise
+
+##
+# Read-only lookups over a built nzsl.db, for services that query the
+# dictionary rather than each writing their own SQL:
+#
+#   dictionary = Dictionary("nzsl.db")
+#   dictionary.word("1234")
+#   dictionary.search("hap")
+#   dictionary.topics(), dictionary.topic_words("Animals")
+#   dictionary.videos("1234"), dictionary.examples("1234")
+#
+# The database is opened with immutable=1, so SQLite doesn't lock or check the
+# file for changes between queries, and is read through a memory map of up to
+# DEFAULT_MMAP_SIZE bytes rather than copied into SQLite's page cache. The file
+# must not change while it is open: replace it with a new file and open that
+# instead. Each query is a fixed statement, so sqlite3 prepares it once and
+# reuses it, and the last DEFAULT_CACHE_SIZE results of each lookup are kept.
+#
+# Results are sqlite3.Row objects, which can be indexed by column name, in
+# tuples, so that cached results can't be changed by the caller.
+#
+#   python3 nzsl_query.py nzsl.db search hap
+
+DEFAULT_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+DEFAULT_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", 1024))
+DEFAULT_SEARCH_LIMIT = 50
+
+# Sorts after every other character, so `column >= term AND column < term +
+# PREFIX_END` matches the values starting with term using the column's index
+PREFIX_END = chr(0x10FFFF)
+
+WORD_QUERY = "SELECT * FROM words WHERE id = ?"
+# Searched in turn, each read in order from its index so that only as many
+# rows as are needed are read
+SEARCH_COLUMNS = ["gloss_normalized", "minor_normalized", "maori_normalized"]
+SEARCH_QUERIES = [f"SELECT * FROM words WHERE {column} >= :term AND {column} < :end ORDER BY {column} LIMIT :limit"
+                  for column in SEARCH_COLUMNS]
+TOPICS_QUERY = "SELECT topic_name AS name, count(*) AS words FROM word_topics GROUP BY topic_name ORDER BY topic_name"
+TOPIC_WORDS_QUERY = """
+    SELECT words.* FROM word_topics JOIN words ON words.id = word_topics.word_id
+    WHERE word_topics.topic_name = ? ORDER BY words.gloss_normalized, CAST(words.id AS INTEGER)
+"""
+VIDEOS_QUERY = "SELECT * FROM videos WHERE word_id = ? ORDER BY video_type, display_order, filename"
+EXAMPLES_QUERY = "SELECT * FROM examples WHERE word_id = ? ORDER BY display_order"
+
+
+class Dictionary:
+    def __init__(self, database_filename, mmap_size=DEFAULT_MMAP_SIZE, cache_size=DEFAULT_CACHE_SIZE):
+        self.filename = database_filename
+        uri = f"file:{quote(os.path.abspath(database_filename))}?mode=ro&immutable=1"
+        self.db = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute(f"PRAGMA mmap_size = {int(mmap_size)}")
+        # One connection is shared by every thread, so queries take turns on it
+        self._lock = threading.Lock()
+
+        for lookup in ("word", "search", "topics", "topic_words", "videos", "examples"):
+            setattr(self, lookup, lru_cache(maxsize=cache_size)(getattr(self, lookup)))
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return tuple(self.db.execute(sql, params).fetchall())
+
+    def word(self, word_id):
+        """
+        The row of the words table for word_id, or None if there isn't one.
+        """
+        rows = self._query(WORD_QUERY, (str(word_id),))
+        return rows[0] if rows else None
+
+    def search(self, term, limit=DEFAULT_SEARCH_LIMIT):
+        """
+        Up to `limit` words whose gloss, secondary gloss or Māori gloss starts
+        with term, ignoring case and diacritics: those matching on their gloss
+        first, then on their secondary gloss, then on their Māori gloss, each
+        in the order of the matching column.
+        """
+        term = normalise(term).strip()
+        if not term:
+            return ()
+        params = {"term": term, "end": term + PREFIX_END, "limit": limit}
+        words = {}
+        for sql in SEARCH_QUERIES:
+            for row in self._query(sql, params):
+                words.setdefault(row["id"], row)
+            if len(words) >= limit:
+                break
+        return tuple(words.values())[:limit]
+
+    def topics(self):
+        """
+        Each topic, as its name and the number of words in it.
+        """
+        return self._query(TOPICS_QUERY)
+
+    def topic_words(self, topic_name):
+        return self._query(TOPIC_WORDS_QUERY, (topic_name,))
+
+    def videos(self, word_id):
+        return self._query(VIDEOS_QUERY, (str(word_id),))
+
+    def examples(self, word_id):
+        return self._query(EXAMPLES_QUERY, (str(word_id),))
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="%prog DB (word ID | search TERM | topics | topic NAME | videos ID | examples ID)")
+    (options, args) = parser.parse_args()
+    lookups = {"word": 1, "search": 1, "topics": 0, "topic": 1, "videos": 1, "examples": 1}
+    if len(args) < 2 or args[1] not in lookups or len(args) != 2 + lookups[args[1]]:
+        parser.error("expected a database and a lookup")
+
+    with Dictionary(args[0]) as dictionary:
+        lookup = getattr(dictionary, "topic_words" if args[1] == "topic" else args[1])
+        result = lookup(*args[2:])
+        for row in (result if isinstance(result, tuple) else [result] if result else []):
+            print("\t".join("" if value is None else str(value) for value in row))
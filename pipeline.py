@@ -0,0 +1,164 @@
+import hashlib
+import json
+import os
+import time
+from collections import namedtuple
+
+import log
+import metrics
+
+logger = log.get_logger(__name__)
+
+##
+# A small runner for the named stages of a build, which records each completed
+# stage in a state file so that a build that fails part way through can be run
+# again and pick up where it left off.
+#
+# A stage's fingerprint covers its input files, its options, and the run of the
+# stage before it. A stage is skipped if it completed last time with the same
+# fingerprint and its outputs still exist; otherwise it is run, and since that
+# changes the fingerprint of every stage after it, they are run too.
+#
+#  - inputs: files or folders the stage reads. Files are fingerprinted by their
+#    content, folders by the names, sizes and modification times of their files.
+#  - outputs: files or folders the stage writes, which must exist for it to be
+#    considered complete.
+#  - options: anything else that changes what the stage does.
+#  - rerun_with: earlier stages that must be run again whenever this one is,
+#    because this stage changes their outputs in place (e.g. processing images
+#    in the folder the previous stage filled).
+#
+# A stage that raises isn't recorded as complete. One that carries on past
+# failures of individual items (e.g. a download or an image) raises StageFailed
+# once it has done everything else it can, so that it is run again next time.
+
+Stage = namedtuple("Stage", ["name", "description", "run", "inputs", "outputs", "options", "rerun_with"],
+                   defaults=[(), (), None, ()])
+
+DEFAULT_STATE_FILENAME = ".build-state.json"
+
+
+class StageFailed(Exception):
+    pass
+
+
+def _path_fingerprint(path, digest):
+    digest.update(path.encode())
+    if os.path.isdir(path):
+        for directory, dirs, files in sorted(os.walk(path)):
+            dirs.sort()
+            for name in sorted(files):
+                stat = os.stat(os.path.join(directory, name))
+                digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    elif os.path.isfile(path):
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+    else:
+        digest.update(b"<missing>")
+
+
+def fingerprint(stage, previous_token):
+    digest = hashlib.sha256(stage.name.encode())
+    digest.update((previous_token or "").encode())
+    digest.update(json.dumps(stage.options, sort_keys=True, default=str).encode())
+    for path in stage.inputs:
+        _path_fingerprint(path, digest)
+    return digest.hexdigest()
+
+
+def load_state(state_filename):
+    if not os.path.exists(state_filename):
+        return {}
+    with open(state_filename) as f:
+        return json.load(f)
+
+
+def save_state(state, state_filename):
+    temp_filename = state_filename + ".part"
+    with open(temp_filename, "w") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(temp_filename, state_filename)
+
+
+def _run_stage(stage, state, state_filename, previous_token, profile=None):
+    logger.info(f"Stage {stage.name}: {stage.description}", extra={"fields": {"stage": stage.name}})
+    state.pop(stage.name, None)
+    save_state(state, state_filename)
+
+    started = time.time()
+    with metrics.stage(stage.name, profile=profile):
+        try:
+            stage.run()
+        except StageFailed as e:
+            logger.error(f"Stage {stage.name} failed: {e}", extra={"fields": {"stage": stage.name, "failed": True}})
+            raise
+    # The fingerprint is taken once the stage has run, as later stages depend on
+    # this particular run of it
+    stage_fingerprint = fingerprint(stage, previous_token)
+    state[stage.name] = {
+        "fingerprint": stage_fingerprint,
+        "token": hashlib.sha256(f"{stage_fingerprint}:{time.time()}".encode()).hexdigest(),
+        "completed_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "seconds": round(time.time() - started, 1),
+    }
+    save_state(state, state_filename)
+    return state[stage.name]["token"]
+
+
+def _is_complete(stage, record, previous_token):
+    return (record is not None
+            and all(os.path.exists(path) for path in stage.outputs)
+            and record["fingerprint"] == fingerprint(stage, previous_token))
+
+
+def run_stages(stages, state_filename=DEFAULT_STATE_FILENAME, only=None, fresh=False, profile=None):
+    """
+    Runs the stages in order, resuming from the first one that is not up to date.
+
+    :param only: run just the named stage (and any it must be rerun with),
+                 whether or not it is up to date
+    :param fresh: ignore the recorded state and run every stage
+    :param profile: profile each stage that is run with "cprofile" or
+                    "tracemalloc" (see metrics.stage)
+    """
+    names = [stage.name for stage in stages]
+    if only is not None and only not in names:
+        raise ValueError(f"Unknown stage {only!r}, expected one of {', '.join(names)}")
+
+    state = {} if fresh else load_state(state_filename)
+
+    if only is not None:
+        to_run = {only}
+    else:
+        # Re-running a stage makes every stage after it stale, so the stages to
+        # run are always everything from the first stale one onwards
+        start = len(stages)
+        previous_token = None
+        for i, stage in enumerate(stages):
+            record = state.get(stage.name)
+            if not _is_complete(stage, record, previous_token):
+                start = i
+                break
+            previous_token = record["token"]
+        to_run = set(names[start:])
+
+    # Pull in stages that have to be redone alongside the ones being run
+    while True:
+        required = {name for stage in stages if stage.name in to_run for name in stage.rerun_with}
+        if required <= to_run:
+            break
+        to_run |= required
+    if only is None and to_run:
+        to_run = set(names[min(names.index(name) for name in to_run):])
+
+    previous_token = None
+    for stage in stages:
+        record = state.get(stage.name)
+        if stage.name in to_run:
+            previous_token = _run_stage(stage, state, state_filename, previous_token, profile)
+        else:
+            if only is None:
+                logger.info(f"Stage {stage.name}: up to date, skipping",
+                            extra={"fields": {"stage": stage.name, "skipped": True}})
+            previous_token = record["token"] if record else None
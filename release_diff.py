@@ -0,0 +1,233 @@
+#!/usr/bin/python
+import gzip
+import hashlib
+import os
+import shutil
+import sqlite3
+import sys
+from collections import Counter
+from optparse import OptionParser
+
+##
+# Produces a patch that turns one release of nzsl.db into another, so that
+# clients holding the previous release can apply a few kilobytes of SQL rather
+# than downloading the whole database again:
+#
+#   python3 release_diff.py diff previous/nzsl.db nzsl.db nzsl.patch.sql.gz
+#   python3 release_diff.py apply previous/nzsl.db nzsl.patch.sql.gz --output patched.db
+#
+# A patch is plain SQL, run in a single transaction. It records the
+# `PRAGMA user_version` it applies to and produces, and a checksum of the
+# resulting content; `apply` refuses to apply a patch to the wrong release and
+# verifies the checksum before committing it, rolling it back if it doesn't
+# match. Rows are compared on content, so a patched
+# database holds exactly the same rows as the new release, though not
+# necessarily in the same order on disk.
+#
+# Patches can only describe changes to rows. If the schema differs between the
+# two releases, the whole database has to be shipped instead.
+
+##
+# The tables compared, and the columns that identify a row in each. Tables
+# without a key are compared as multisets of whole rows.
+
+PATCH_TABLES = {
+    "words": ["id"],
+    "topics": ["name"],
+    "word_topics": None,
+    "examples": None,
+    "videos": ["word_id", "video_type", "filename"],
+    "words_search": ["word_id"],
+}
+
+
+class SchemaChanged(Exception):
+    pass
+
+
+def sql_literal(value):
+    if value is None:
+        return "NULL"
+    if isinstance(value, bytes):
+        return "X'" + value.hex() + "'"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _where(columns, values):
+    return " AND ".join(f"{column} IS {sql_literal(value)}" for column, value in zip(columns, values))
+
+
+def _tables(db):
+    return {name: sql for name, sql in db.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'table' AND name IN (%s)"
+        % ",".join("?" * len(PATCH_TABLES)), list(PATCH_TABLES))}
+
+
+def _columns(db, table):
+    return [row[1] for row in db.execute(f"PRAGMA table_info({table})")]
+
+
+def _user_version(db):
+    return db.execute("PRAGMA user_version").fetchone()[0]
+
+
+def content_checksum(db):
+    """
+    A checksum of the release version and every row of the patched tables,
+    independent of the order rows are stored in.
+    """
+    digest = hashlib.sha256(str(_user_version(db)).encode())
+    for table in sorted(_tables(db)):
+        digest.update(table.encode())
+        for row in sorted(repr(row) for row in db.execute(f"SELECT * FROM {table}")):
+            digest.update(row.encode())
+    return digest.hexdigest()
+
+
+def _diff_keyed(table, columns, key, old_rows, new_rows):
+    key_indexes = [columns.index(k) for k in key]
+    old = {tuple(row[i] for i in key_indexes): row for row in old_rows}
+    new = {tuple(row[i] for i in key_indexes): row for row in new_rows}
+
+    for k in old.keys() - new.keys():
+        yield f"DELETE FROM {table} WHERE {_where(key, k)};"
+    for k in new.keys() & old.keys():
+        if old[k] == new[k]:
+            continue
+        changes = ", ".join(f"{column} = {sql_literal(value)}"
+                            for column, value, previous in zip(columns, new[k], old[k]) if value != previous)
+        yield f"UPDATE {table} SET {changes} WHERE {_where(key, k)};"
+    for k in new.keys() - old.keys():
+        yield f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(map(sql_literal, new[k]))});"
+
+
+def _diff_multiset(table, columns, old_rows, new_rows):
+    old = Counter(old_rows)
+    new = Counter(new_rows)
+    for row, count in (old - new).items():
+        for _ in range(count):
+            yield (f"DELETE FROM {table} WHERE rowid = "
+                   f"(SELECT rowid FROM {table} WHERE {_where(columns, row)} LIMIT 1);")
+    for row, count in (new - old).items():
+        for _ in range(count):
+            yield f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(map(sql_literal, row))});"
+
+
+def diff(old_filename, new_filename):
+    """
+    Yields the lines of a SQL patch turning the database old_filename into
+    new_filename.
+    """
+    old_db = sqlite3.connect(old_filename)
+    new_db = sqlite3.connect(new_filename)
+    old_tables = _tables(old_db)
+    new_tables = _tables(new_db)
+    if old_tables != new_tables:
+        raise SchemaChanged(f"Tables differ between {old_filename} and {new_filename}")
+
+    yield f"-- nzsl.db patch from {_user_version(old_db)} to {_user_version(new_db)}"
+    yield f"-- base: {_user_version(old_db)}"
+    yield f"-- checksum: {content_checksum(new_db)}"
+    yield "BEGIN;"
+    for table, key in PATCH_TABLES.items():
+        if table not in new_tables:
+            continue
+        columns = _columns(new_db, table)
+        old_rows = old_db.execute(f"SELECT * FROM {table}").fetchall()
+        new_rows = new_db.execute(f"SELECT * FROM {table}").fetchall()
+        if key:
+            yield from _diff_keyed(table, columns, key, old_rows, new_rows)
+        else:
+            yield from _diff_multiset(table, columns, old_rows, new_rows)
+    yield f"PRAGMA user_version = {_user_version(new_db)};"
+    yield "COMMIT;"
+    old_db.close()
+    new_db.close()
+
+
+def _open(filename, mode):
+    if filename.endswith(".gz"):
+        return gzip.open(filename, mode + "t", encoding="utf-8")
+    return open(filename, mode, encoding="utf-8")
+
+
+def write_patch(old_filename, new_filename, patch_filename):
+    changes = 0
+    with _open(patch_filename, "w") as f:
+        for line in diff(old_filename, new_filename):
+            if not line.startswith(("--", "BEGIN", "COMMIT", "PRAGMA")):
+                changes += 1
+            f.write(line + "\n")
+    return changes
+
+
+def _header(patch, name):
+    prefix = f"-- {name}: "
+    for line in patch.splitlines():
+        if line.startswith(prefix):
+            return line[len(prefix):]
+        if not line.startswith("--"):
+            break
+    raise ValueError(f"Patch has no {name} header")
+
+
+def apply_patch(database_filename, patch_filename, output_filename=None):
+    """
+    Applies a patch to database_filename, or to a copy of it at output_filename,
+    and checks the result matches the release the patch was made from. The
+    patch is only committed once it has been checked, so a database it can't be
+    applied to is left as it was, and a copy made for output_filename is
+    removed.
+    """
+    with _open(patch_filename, "r") as f:
+        patch = f.read()
+    # The patch's own transaction is replaced with one that is only committed
+    # once the checksum matches
+    body = "\n".join(line for line in patch.splitlines() if line not in ("BEGIN;", "COMMIT;"))
+
+    copied = output_filename and output_filename != database_filename
+    if copied:
+        shutil.copyfile(database_filename, output_filename)
+        database_filename = output_filename
+
+    db = sqlite3.connect(database_filename, isolation_level=None)
+    try:
+        base = int(_header(patch, "base"))
+        if _user_version(db) != base:
+            raise ValueError(f"Patch applies to release {base}, but {database_filename} is {_user_version(db)}")
+        try:
+            db.executescript("BEGIN;\n" + body)
+            if content_checksum(db) != _header(patch, "checksum"):
+                raise ValueError(f"{database_filename} would not match the expected release after patching, "
+                                 "so the patch has not been applied")
+            db.execute("COMMIT")
+        except BaseException:
+            if db.in_transaction:
+                db.execute("ROLLBACK")
+            raise
+    except BaseException:
+        db.close()
+        if copied:
+            os.unlink(database_filename)
+        raise
+    db.close()
+
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="%prog diff OLD_DB NEW_DB PATCH\n       %prog apply DB PATCH [--output OUTPUT_DB]")
+    parser.add_option("--output", dest="output", help="apply: write the patched database here instead of in place")
+    (options, args) = parser.parse_args()
+
+    if len(args) == 4 and args[0] == "diff":
+        try:
+            changes = write_patch(args[1], args[2], args[3])
+        except SchemaChanged as e:
+            sys.exit(f"{e}; the full database must be shipped for this release")
+        print(f"Wrote {changes} changes to {args[3]}")
+    elif len(args) == 3 and args[0] == "apply":
+        apply_patch(args[1], args[2], options.output)
+        print(f"Patched {options.output or args[1]}")
+    else:
+        parser.error("expected diff OLD_DB NEW_DB PATCH or apply DB PATCH")
@@ -0,0 +1,238 @@
+#!/usr/bin/python
+import gzip
+import os
+import shutil
+import sqlite3
+from optparse import OptionParser
+
+import datfile
+import filesystem
+import log
+
+##
+# Finalises nzsl.db for distribution, so that the same data always produces the
+# same, compact file:
+#
+#   python3 release_package.py nzsl.db --compress gz,zst
+#
+#  - every table is rewritten in primary key order, so rows don't end up in
+#    whatever order the exports happened to list them
+#  - the page size is set to DEFAULT_PAGE_SIZE
+#  - ANALYZE records statistics for the query planner, and VACUUM INTO writes
+#    a copy with no free pages
+#  - nzsl.dat is written from the words as they are copied, rather than by
+#    reading the database back again afterwards
+#  - optionally, nzsl.db.gz and nzsl.db.zst are written alongside, and the
+#    SHA-256 of each file is listed in SHA256SUMS (check with `sha256sum -c`)
+#
+# zst compression needs the `zstandard` package, or Python 3.14's
+# compression.zstd; it is only imported if it is asked for.
+
+# Matches the 4KiB pages of the filesystems and flash storage the apps read the
+# database from, so each page the apps read is a single read from storage
+DEFAULT_PAGE_SIZE = int(os.getenv("SQLITE_PAGE_SIZE", 4096))
+COMPRESSIONS = ["gz", "zst"]
+CHECKSUMS_FILENAME = "SHA256SUMS"
+
+##
+# The order rows are written in for each table. Ties, and tables not listed,
+# are ordered by every column.
+
+ROW_ORDER = {
+    "words": ["CAST(id AS INTEGER)", "id"],
+    "topics": ["name"],
+    "word_topics": ["CAST(word_id AS INTEGER)", "word_id", "topic_name"],
+    "examples": ["CAST(word_id AS INTEGER)", "word_id", "display_order"],
+    "videos": ["CAST(word_id AS INTEGER)", "word_id", "video_type", "display_order", "filename"],
+    "words_search": ["CAST(word_id AS INTEGER)", "word_id"],
+}
+
+logger = log.get_logger(__name__)
+
+
+def _columns(db, schema, table):
+    return [row[1] for row in db.execute(f"PRAGMA {schema}.table_info({table})")]
+
+
+def _schema(db):
+    """
+    The tables, and then the indexes, triggers and views, of the attached
+    `source` database, leaving out SQLite's internal tables and the tables
+    full text search indexes keep their data in, which are recreated along
+    with their index.
+    """
+    objects = db.execute("SELECT type, name, sql FROM source.sqlite_master WHERE sql IS NOT NULL "
+                         "AND name NOT LIKE 'sqlite_%' ORDER BY rowid").fetchall()
+    virtual_tables = [name for kind, name, sql in objects
+                      if kind == "table" and sql.upper().startswith("CREATE VIRTUAL TABLE")]
+    tables = [(name, sql) for kind, name, sql in objects if kind == "table"
+              and not any(name.startswith(f"{virtual}_") for virtual in virtual_tables)]
+    others = [sql for kind, name, sql in objects if kind != "table"]
+    return tables, virtual_tables, others
+
+
+def _copy_words(db, columns, select, dat):
+    # The words are copied through Python rather than with INSERT ... SELECT so
+    # that each is written to nzsl.dat on the way
+    dat_indexes = [columns.index(column) for column in datfile.DAT_COLUMNS]
+
+    def rows():
+        for row in db.execute(select):
+            dat.write([row[i] for i in dat_indexes])
+            yield row
+
+    db.executemany(f"INSERT INTO main.words ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                   rows())
+
+
+def finalise_database(database_filename, output_filename=None, page_size=DEFAULT_PAGE_SIZE, dat_filename=None):
+    """
+    Writes a compact copy of database_filename to output_filename (by default,
+    replacing it), with its rows in primary key order, and if dat_filename is
+    given writes nzsl.dat from the same rows.
+    """
+    output_filename = output_filename or database_filename
+    ordered_filename = output_filename + ".ordered"
+    compact_filename = output_filename + ".part"
+    dat_part_filename = dat_filename + ".part" if dat_filename else None
+    for filename in (ordered_filename, compact_filename, dat_part_filename):
+        if filename and os.path.exists(filename):
+            os.unlink(filename)
+    dat = datfile.DatWriter(dat_part_filename) if dat_filename else None
+
+    db = sqlite3.connect(ordered_filename, isolation_level=None)
+    try:
+        db.execute(f"PRAGMA page_size = {int(page_size)}")
+        db.execute("PRAGMA journal_mode = OFF")
+        db.execute("PRAGMA synchronous = OFF")
+        db.execute("ATTACH DATABASE ? AS source", (database_filename,))
+        db.execute(f"PRAGMA user_version = {db.execute('PRAGMA source.user_version').fetchone()[0]}")
+
+        tables, virtual_tables, others = _schema(db)
+        db.execute("BEGIN")
+        for table, sql in tables:
+            db.execute(sql)
+            columns = _columns(db, "source", table)
+            order = ", ".join(ROW_ORDER.get(table, []) + columns)
+            column_list = ", ".join(columns)
+            select = f"SELECT {column_list} FROM source.{table} ORDER BY {order}"
+            if table == "words" and dat is not None:
+                _copy_words(db, columns, select, dat)
+            else:
+                db.execute(f"INSERT INTO main.{table} ({column_list}) {select}")
+        for table in virtual_tables:
+            db.execute(f"INSERT INTO main.{table} ({table}) VALUES ('optimize')")
+        db.execute("COMMIT")
+        # Indexes are built once the rows are in place, as write_sqlitefile does
+        for sql in others:
+            db.execute(sql)
+        db.execute("DETACH DATABASE source")
+
+        db.execute("ANALYZE")
+        db.execute("VACUUM INTO ?", (compact_filename,))
+    finally:
+        db.close()
+        os.unlink(ordered_filename)
+        if dat is not None:
+            dat.close()
+    os.replace(compact_filename, output_filename)
+    if dat is not None:
+        os.replace(dat_part_filename, dat_filename)
+        logger.info(f"Wrote {dat.lines} words to {dat_filename}")
+    logger.info(f"Finalised {output_filename} ({os.path.getsize(output_filename) / 1_000_000:.1f} MB, "
+                f"{int(page_size)} byte pages)")
+
+
+def _zstd_open(filename):
+    try:
+        from compression import zstd
+        return zstd.open(filename, "wb", level=19)
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("zst compression needs Python 3.14 or the zstandard package (pip install zstandard)")
+    return zstandard.ZstdCompressor(level=19).stream_writer(open(filename, "wb"), closefd=True)
+
+
+def check_compressions(compressions):
+    """
+    Raises ValueError for an unknown compression, or ImportError if one can't
+    be used here, so a build can fail before doing any work rather than at the
+    end.
+    """
+    for compression in compressions:
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression {compression!r}, expected one of {', '.join(COMPRESSIONS)}")
+        if compression == "zst":
+            _zstd_open(os.devnull).close()
+
+
+def compress(filename, compression):
+    """
+    Writes filename.gz or filename.zst. The output only depends on the content
+    of filename, so an unchanged database compresses to an identical file.
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression {compression!r}, expected one of {', '.join(COMPRESSIONS)}")
+    output_filename = f"{filename}.{compression}"
+    temp_filename = output_filename + ".part"
+    with open(filename, "rb") as source:
+        if compression == "gz":
+            # No name or modification time in the header
+            with open(temp_filename, "wb") as f, gzip.GzipFile(fileobj=f, mode="wb", filename="",
+                                                               mtime=0, compresslevel=9) as out:
+                shutil.copyfileobj(source, out, 1024 * 1024)
+        else:
+            with _zstd_open(temp_filename) as out:
+                shutil.copyfileobj(source, out, 1024 * 1024)
+    os.replace(temp_filename, output_filename)
+    return output_filename
+
+
+def write_checksums(filenames, checksums_filename=None):
+    """
+    Writes the SHA-256 of each file, in the format `sha256sum` reads, to
+    checksums_filename (by default SHA256SUMS alongside the first file).
+    """
+    checksums_filename = checksums_filename or os.path.join(os.path.dirname(filenames[0]), CHECKSUMS_FILENAME)
+    with open(checksums_filename, "w") as f:
+        for filename in filenames:
+            f.write(f"{filesystem.file_sha256(filename)}  {os.path.basename(filename)}\n")
+    return checksums_filename
+
+
+def package_database(database_filename, compressions=(), page_size=DEFAULT_PAGE_SIZE, dat_filename=None):
+    """
+    Finalises database_filename in place, writes nzsl.dat from it if
+    dat_filename is given, writes any compressed copies of the database, and
+    lists them all in SHA256SUMS. Returns the database files written.
+    """
+    finalise_database(database_filename, page_size=page_size, dat_filename=dat_filename)
+    artefacts = [database_filename] + [compress(database_filename, compression) for compression in compressions]
+    for artefact in artefacts[1:]:
+        logger.info(f"Wrote {artefact} ({os.path.getsize(artefact) / 1_000_000:.1f} MB)")
+    return artefacts + [write_checksums(artefacts)]
+
+
+def artefact_filenames(database_filename, compressions=()):
+    """
+    The files package_database writes for database_filename.
+    """
+    return ([database_filename] + [f"{database_filename}.{compression}" for compression in compressions]
+            + [os.path.join(os.path.dirname(database_filename), CHECKSUMS_FILENAME)])
+
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="%prog DB [--compress gz,zst] [--page-size BYTES] [--dat nzsl.dat]")
+    parser.add_option("--compress", dest="compress", default="",
+                      help="Comma-separated compressed copies to write alongside the database (gz, zst)")
+    parser.add_option("--page-size", type="int", dest="page_size", default=DEFAULT_PAGE_SIZE)
+    parser.add_option("--dat", dest="dat", help="Also write the words to this .dat file for Android")
+    (options, args) = parser.parse_args()
+    if len(args) != 1:
+        parser.error("expected the database to finalise")
+
+    log.configure()
+    package_database(args[0], [c for c in options.compress.split(",") if c], options.page_size, options.dat)
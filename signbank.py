@@ -1,58 +1,109 @@
 import csv
+import logging
+import multiprocessing
+import operator
 import os
 import re
 import shutil
 import sqlite3
-import time
 
-import requests
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from requests.adapters import HTTPAdapter, Retry
-from requests.exceptions import ChunkedEncodingError
-from urllib3.exceptions import ProtocolError
+from itertools import islice
+from urllib.parse import urlsplit
+
+import requests
+
+import asset_integrity
+import datfile
+import downloader
+import filesystem
+import http_client
+import log
+import metrics
+import sync_manifest
+from normalisation import normalise
+
+logger = log.get_logger(__name__)
 
 DEFAULT_SIGNBANK_HOST = os.getenv("SIGNBANK_HOST", "https://signbank.nzsl.nz")
 SIGNBANK_DATASET_ID = os.getenv("SIGNBANK_DATASET_ID", 1)
 SIGNBANK_USERNAME = os.getenv("SIGNBANK_USERNAME")
 SIGNBANK_PASSWORD = os.getenv("SIGNBANK_PASSWORD")
 SIGNBANK_WEB_READY_TAG_ID = os.getenv("SIGNBANK_WEB_READY_TAG_ID")
+EXPORT_CHUNK_SIZE = 1024 * 1024
 
 ##
-# Start a requests session that is authenticated to Signbank
+# Start a requests session that is authenticated to Signbank. The session is
+# created once and reused by every request made to Signbank during a run.
+
+SIGNBANK_LOGIN_PATH = "/accounts/login/"
+
 
+def signbank_session(refresh=False):
+    return http_client.authenticated_session("signbank", _signbank_login, refresh=refresh)
 
-def signbank_session():
-    s = requests.Session()
-    s.get(f"{DEFAULT_SIGNBANK_HOST}/accounts/login/")
-    s.post(f"{DEFAULT_SIGNBANK_HOST}/accounts/login/",
-           data={'username': SIGNBANK_USERNAME, 'password': SIGNBANK_PASSWORD,
-                 'csrfmiddlewaretoken': s.cookies['csrftoken']},
-           headers={'Referer': DEFAULT_SIGNBANK_HOST})
 
-    return s
+def _signbank_login(s):
+    s.get(f"{DEFAULT_SIGNBANK_HOST}{SIGNBANK_LOGIN_PATH}").raise_for_status()
+    response = s.post(f"{DEFAULT_SIGNBANK_HOST}{SIGNBANK_LOGIN_PATH}",
+                      data={'username': SIGNBANK_USERNAME, 'password': SIGNBANK_PASSWORD,
+                            'csrfmiddlewaretoken': s.cookies['csrftoken']},
+                      headers={'Referer': DEFAULT_SIGNBANK_HOST}, allow_redirects=False)
+    response.close()
+    # A successful login redirects away from the login page; a failed one shows
+    # the login form again
+    location = urlsplit(response.headers.get('Location', '')).path
+    if not response.is_redirect or location.startswith(SIGNBANK_LOGIN_PATH):
+        raise requests.HTTPError(f"Signbank login failed as {SIGNBANK_USERNAME!r}: the login page returned "
+                                 f"{response.status_code} {response.reason}"
+                                 + (f" redirecting to {location}" if response.is_redirect else ""),
+                                 response=response)
+
+
+def _signbank_login_expired(response):
+    # Signbank redirects to the login page, rather than erroring, when the session
+    # is no longer valid
+    return (response.status_code in (401, 403)
+            or urlsplit(response.url).path.startswith(SIGNBANK_LOGIN_PATH))
+
+
+def signbank_get(path, **kwargs):
+    """
+    Makes a GET request to Signbank with the shared authenticated session,
+    logging in again if the session has expired.
+    """
+    return http_client.authenticated_get("signbank", _signbank_login, _signbank_login_expired,
+                                         f"{DEFAULT_SIGNBANK_HOST}{path}", **kwargs)
+
 
-def get_from_s3(key):
+def get_from_s3(key, headers=None):
     """
-    Makes a GET request to S3, retrying a few times if it errors
-    or if the connection is broken before giving up entirely
+    Makes a GET request to S3 using the shared connection pool, retrying a few
+    times if it errors or if the connection is broken before giving up entirely.
+    Raises an error for a response other than 200 or 304, or a body shorter or
+    longer than its Content-Length, rather than letting an error page or a
+    partial file be saved as the asset.
 
     :param key:
+    :param headers: e.g. conditional request headers
     :return:
     """
-    s = requests.Session()
-    retries = Retry(total=5, backoff_factor=1,
-                    status_forcelist=[502, 503, 504])
-    s.mount('https://', HTTPAdapter(max_retries=retries))
-
-    # the above retry setup will handle occasional connection errors that are done
-    # with a valid HTTP request, but they won't handle when the connection is just
-    # broken, so we also have to explicitly catch protocol errors to attempt a retry
-    try:
-        return s.get(key)
-    except (ProtocolError, ChunkedEncodingError):
-        print("(had to retry get)", end=" ")
-        time.sleep(2) # Wait a couple of seconds before retrying
-        return get_from_s3(key)
+    response = http_client.get(key, headers=headers)
+    if response.status_code == 304:
+        return response
+    response.raise_for_status()
+    # Anything else, e.g. 204 No Content or a 206 Partial Content range, isn't
+    # the whole asset
+    if response.status_code != 200:
+        raise IOError(f"{key}: expected 200 OK, received {response.status_code} {response.reason}")
+    expected_length = response.headers.get('Content-Length')
+    # A compressed body is decompressed by requests, so its length won't match
+    if (expected_length is not None and 'Content-Encoding' not in response.headers
+            and int(expected_length) != len(response.content)):
+        raise IOError(f"{key}: received {len(response.content)} of {expected_length} bytes")
+    return response
 
 
 ##########################
@@ -61,54 +112,113 @@ def get_from_s3(key):
 
 
 def fetch_gloss_export_file(filename, filters = {}):
-    session = signbank_session()
-    response = session.get(f"{DEFAULT_SIGNBANK_HOST}/dictionary/advanced/",
-                           params={**filters, "dataset": SIGNBANK_DATASET_ID, "format": 'CSV-standard'})
-    response.raise_for_status()
-    with open(filename, "wb") as f:
-        f.write(response.content)
+    response = signbank_get("/dictionary/advanced/",
+                            params={**filters, "dataset": SIGNBANK_DATASET_ID, "format": 'CSV-standard'},
+                            stream=True)
+    write_response_to_file(response, filename)
+
+
+def write_response_to_file(response, filename):
+    """
+    Streams a response body to disk in chunks rather than holding it all in
+    memory, only replacing `filename` once the whole body has been received.
+    """
+    with response:
+        response.raise_for_status()
+        filesystem.write_atomically(filename, response.iter_content(chunk_size=EXPORT_CHUNK_SIZE))
+    metrics.count("export.bytes", os.path.getsize(filename))
 
 
+##
+# Yields each row of a Signbank CSV export as a dict keyed by the column headers.
+# Rows are read lazily, so the export is never held in memory all at once; the
+# result can only be iterated over once.
+
 def parse_signbank_csv(filename):
-    with open(filename, 'r') as f:
-        reader = csv.reader(f)
-        headers = next(reader, None)
-        return [{h: x for (h, x) in zip(headers, row)} for row in reader]
+    with open(filename, 'r', newline='') as f:
+        yield from csv.DictReader(f, restval='')
+
+
+def merge_glosses(*exports):
+    """
+    Yields the glosses of several exports (e.g. published and prerelease), each
+    gloss only once: where the same id is in more than one export, the row from
+    the first export it appears in is used, and the rest are dropped along with
+    their examples and topics.
+    """
+    seen = set()
+    duplicates = 0
+    for export in exports:
+        for entry in export:
+            if entry["id"] in seen:
+                duplicates += 1
+                continue
+            seen.add(entry["id"])
+            yield entry
+    if duplicates:
+        logger.info(f"Merged {duplicates} glosses that were in more than one export")
 
 
 ##########################
 # Asset handling
 ##########################
 def fetch_gloss_asset_export_file(filename, filters = {}):
-    session = signbank_session()
+    video_response = signbank_get("/video/csv", params=filters, stream=True)
+    write_response_to_file(video_response, filename)
 
-    video_response = session.get(f"{DEFAULT_SIGNBANK_HOST}/video/csv", params=filters)
-    video_response.raise_for_status()
-    with open(filename, "wb") as f:
-        f.write(video_response.content)
 
+def fetch_gloss_assets(data, database_filename, output_folder, download=True,
+                       workers=downloader.DEFAULT_DOWNLOAD_WORKERS, revalidate=True, on_image=None,
+                       verify_all=False, decode=False):
+    """
+    Records the assets in `data` against their words, and downloads the images.
 
-def fetch_gloss_assets(data, database_filename, output_folder, download=True):
-    if not os.path.exists(output_folder) and download:
-        os.makedirs(output_folder)
+    Images already downloaded are checked against the sync manifest: with
+    `revalidate`, a conditional GET is made so that only changed images are
+    downloaded again; without it, images whose URL and size match the manifest
+    are trusted without making a request at all.
 
-    db = sqlite3.connect(database_filename)
-    db.executescript(
-        """
-        BEGIN;
-        CREATE TABLE videos (
-            word_id, video_type, filename, url, display_order
-        );
-        CREATE UNIQUE INDEX idx_word_videos ON videos (word_id, video_type, filename);
-        COMMIT;
-      """
-    )
+    Before anything is downloaded, images that are new or changed since they
+    were last verified (every image, with verify_all) are checked with
+    asset_integrity, and any that aren't whole PNGs are quarantined so that they
+    are downloaded again. Each image downloaded is checked the same way. With
+    `decode`, every image checked is also decoded.
+
+    If given, on_image is called (on this thread) with the path of each image as
+    soon as it is available locally, so that it can be processed while other
+    images are still downloading.
+
+    Raises downloader.DownloadsFailed once every image has been tried if any
+    couldn't be downloaded, or weren't whole PNGs.
 
+    With no database_filename, the images are downloaded without recording the
+    assets anywhere, e.g. to share one download between several databases.
+    """
+    if not os.path.exists(output_folder) and download:
+        os.makedirs(output_folder)
+    manifest = sync_manifest.open_manifest(output_folder) if download else None
+    if download:
+        asset_integrity.verify_folder(output_folder, manifest, workers, decode, verify_all)
+
+    # Images are downloaded on a pool of worker threads once the database has been
+    # updated; queued_downloads tracks which files have already been scheduled so
+    # that an image shared between several rows is only fetched once.
+    download_jobs = []
+    queued_downloads = set()
+
+    db = _begin_staging_assets(database_filename) if database_filename else None
+    staged_assets = []
+
+    # Checked once up front, as formatting a message for every row is a
+    # noticeable part of the loop when nothing is going to show it
+    debug = logger.isEnabledFor(logging.DEBUG)
+    progress = log.Progress(logger, "Linking assets", unit="rows")
     for entry in data:
-        print(f"{entry['Gloss']} ({entry['Video_type']})", end=" ")
+        progress.update()
         gloss_parts = entry['Gloss'].split(':')
         if (len(gloss_parts) < 2):
-            print(f"skipped - couldn't extract gloss ID")
+            if debug:
+                logger.debug("%s (%s) skipped - couldn't extract gloss ID", entry['Gloss'], entry['Video_type'])
             continue
 
         gloss_id = gloss_parts[-1]
@@ -119,57 +229,167 @@ def fetch_gloss_assets(data, database_filename, output_folder, download=True):
         filename = os.path.join(output_folder, basename)
 
         if filename.endswith(".webm"):
-            print("skipped - webm video")
+            if debug:
+                logger.debug("%s (%s) skipped - webm video", entry['Gloss'], video_type)
             continue
 
         # We don't need to download videos, just know where they are
+        status = "not downloaded"
         if download and filename.endswith(".png"):
-            if download and not os.path.exists(filename):
-                asset_request = get_from_s3(entry['Videofile'])
-                with open(filename, "wb") as asset_file:
-                    asset_file.write(asset_request.content)
-                print("downloaded", end=", ")
+            manifest_entry = sync_manifest.lookup(manifest, basename)
+            if filename in queued_downloads:
+                status = "already queued"
+            elif not revalidate and sync_manifest.is_current(manifest_entry, filename, url):
+                status = "already downloaded"
+                if on_image:
+                    on_image(filename)
             else:
-                print("already downloaded", end=", ")
+                queued_downloads.add(filename)
+                http_client.size_pool_for(url, workers)
+                headers = sync_manifest.conditional_headers(manifest_entry, filename, url)
+                download_jobs.append(downloader.DownloadJob(entry['Gloss'], url, filename, headers))
+                status = "queued for revalidation" if headers else "queued for download"
         elif download:
-            print("not an image, skipping download", end=", ")
-
-        # Update the words table with the picture, if this is an image and of type main
-        if video_type == 'main' and filename.endswith('.png'):
-            db.execute("UPDATE words SET picture = :basename WHERE id = :gloss_id",
-                       {'basename': basename, 'gloss_id': gloss_id})
-            print("assigned as main picture", end=", ")
-
-        # Update the words table with the video URL, if this is a video and of type main
-        if video_type == 'main' and filename.endswith('.mp4'):
-            db.execute(
-                "UPDATE words SET video = :url WHERE id = :gloss_id",
-                {'gloss_id': gloss_id, 'url': url}
-            )
-            print("assigned as main video", end=", ")
+            status = "not an image, skipping download"
 
+        example_order = None
         if video_type.startswith("finalexample"):
             # finalexample{1,2,3,4} - this won't scale to double digits
-            display_order = int(video_type[-1])
-            db.execute("UPDATE examples SET video = :url WHERE word_id = :gloss_id AND display_order = :display_order",
-                       {'display_order': display_order, 'gloss_id': gloss_id, 'url': url})
-
-        # Insert the video data
-        db.execute(
-            """
-            INSERT INTO videos (word_id, video_type, filename, url, display_order)
-                        VALUES (:word_id, :video_type, :filename, :url, :display_order)
-                        ON CONFLICT DO NOTHING
-            """, {
-                'word_id': gloss_id,
-                'video_type': video_type,
-                'filename': basename,
-                'url': url,
-                'display_order': entry['Version']
-            }
+            example_order = int(video_type[-1])
+
+        if db is not None:
+            staged_assets.append((gloss_id, video_type, basename, url, entry['Version'], example_order))
+            if len(staged_assets) >= SQLITE_BATCH_SIZE:
+                db.executemany("INSERT INTO staged_assets VALUES (?, ?, ?, ?, ?, ?)", staged_assets)
+                staged_assets = []
+        if debug:
+            logger.debug("%s (%s) %s%s", entry['Gloss'], video_type, status, ", staged" if db is not None else "")
+    progress.finish()
+    if db is not None:
+        db.executemany("INSERT INTO staged_assets VALUES (?, ?, ?, ?, ?, ?)", staged_assets)
+        _link_staged_assets(db)
+
+    stats = downloader.DownloadStats()
+    if download_jobs:
+        logger.info(f"Downloading {len(download_jobs)} images using {workers} workers")
+    progress = log.Progress(logger, "Downloading images", total=len(download_jobs), unit="images")
+    failed = 0
+    for result in downloader.download_all(download_jobs, get_from_s3, workers=workers, stats=stats):
+        progress.update()
+        basename = os.path.basename(result.filename)
+        if result.not_modified:
+            if debug:
+                logger.debug("%s: %s unchanged", result.key, basename)
+            if sync_manifest.lookup(manifest, basename) is None:
+                # Adopt a file downloaded before the manifest existed
+                sync_manifest.record(manifest, basename, result.url, result.etag, result.last_modified,
+                                     os.path.getsize(result.filename), filesystem.file_sha256(result.filename))
+        elif result.ok:
+            problem = asset_integrity.check_png(result.filename, decode)
+            if problem:
+                asset_integrity.quarantine(output_folder, basename, f"downloaded from {result.url}: {problem}",
+                                           manifest)
+                failed += 1
+                continue
+            if debug:
+                logger.debug("%s: downloaded %s", result.key, basename)
+            sync_manifest.record(manifest, basename, result.url, result.etag, result.last_modified,
+                                 result.size, result.sha256)
+            asset_integrity.mark_verified(manifest, result.filename)
+        else:
+            failed += 1
+            logger.warning(f"{result.key}: failed to download {result.url} - {result.error}",
+                           extra={"fields": {"gloss": result.key, "url": result.url}})
+        if on_image and os.path.exists(result.filename):
+            on_image(result.filename)
+    if manifest is not None:
+        manifest.commit()
+        manifest.close()
+    logger.info(f"Asset download throughput: {stats.summary()}")
+    # Raised only now, so everything that could be downloaded has been, and is
+    # in the manifest for next time
+    if failed:
+        raise downloader.DownloadsFailed(f"{failed} of {len(download_jobs)} images failed to download")
+    return stats
+
+
+def _begin_staging_assets(database_filename):
+    db = sqlite3.connect(database_filename, isolation_level=None)
+    # Anything a previous, possibly interrupted, run added is replaced, so that
+    # this step can be run again on the same database
+    db.executescript(
+        """
+        BEGIN;
+        DROP TABLE IF EXISTS videos;
+        CREATE TABLE videos (
+            word_id, video_type, filename, url, display_order
+        );
+        CREATE UNIQUE INDEX idx_word_videos ON videos (word_id, video_type, filename);
+        COMMIT;
+      """
+    )
+
+    # Every asset row is loaded into a staging table first, and words and examples
+    # are then linked to their assets with a handful of set-based updates rather
+    # than several statements per row.
+    db.execute("BEGIN")
+    db.execute(
+        """
+        CREATE TEMP TABLE staged_assets (
+            word_id, video_type, filename, url, display_order, example_order
         )
-        db.commit()
-        print("added to database")
+      """
+    )
+    return db
+
+
+def _link_staged_assets(db):
+    db.execute("UPDATE words SET picture = '', video = ''")
+    db.execute("UPDATE examples SET video = NULL")
+
+    # Where a word has more than one candidate asset, the last one in the export
+    # wins (max(rowid) picks the values from that row).
+    pictures = db.execute(
+        """
+        UPDATE words SET picture = staged.filename
+        FROM (SELECT word_id, filename, max(rowid) FROM staged_assets
+              WHERE video_type = 'main' AND substr(filename, -4) = '.png'
+              GROUP BY word_id) AS staged
+        WHERE words.id = staged.word_id
+      """
+    ).rowcount
+    videos = db.execute(
+        """
+        UPDATE words SET video = staged.url
+        FROM (SELECT word_id, url, max(rowid) FROM staged_assets
+              WHERE video_type = 'main' AND substr(filename, -4) = '.mp4'
+              GROUP BY word_id) AS staged
+        WHERE words.id = staged.word_id
+      """
+    ).rowcount
+    example_videos = db.execute(
+        """
+        UPDATE examples SET video = staged.url
+        FROM (SELECT word_id, example_order, url, max(rowid) FROM staged_assets
+              WHERE example_order IS NOT NULL
+              GROUP BY word_id, example_order) AS staged
+        WHERE examples.word_id = staged.word_id AND examples.display_order = staged.example_order
+      """
+    ).rowcount
+    assets = db.execute(
+        """
+        INSERT INTO videos (word_id, video_type, filename, url, display_order)
+        SELECT word_id, video_type, filename, url, display_order FROM staged_assets WHERE true ORDER BY rowid
+        ON CONFLICT DO NOTHING
+      """
+    ).rowcount
+    db.execute("DROP TABLE staged_assets")
+    db.execute("COMMIT")
+    db.close()
+    metrics.count("rows.videos", assets)
+    logger.info(f"Added {assets} assets to the database, linked {pictures} main pictures, "
+                f"{videos} main videos and {example_videos} example videos")
+
 
 # Modify filenames to match the Android requirements (lowercase a-z and _ only)
 # Since iOS uses the same underlying data, update iOS to use the same image names.
@@ -185,7 +405,8 @@ def prune_orphan_assets(database_filename):
         """
     )
     deleted_records = cursor.rowcount
-    print(f"Pruned {deleted_records} assets not associated with a word")
+    metrics.count("rows.videos_pruned", deleted_records)
+    logger.info(f"Pruned {deleted_records} assets not associated with a word")
 
 
 
@@ -203,160 +424,234 @@ def normalize_asset_filename(filename):
 
 # The .dat file is used by the Android application, rather than SQLite, for
 # historical reasons. It only includes the data required by the application, not
-# including new data added to the SQLite database.
+# including new data added to the SQLite database. See datfile.py for the format;
+# the build writes it while finalising the database (release_package.py).
 
 def write_datfile(database_filename, dat_file_filename):
     db = sqlite3.connect(database_filename)
-    db.row_factory = sqlite3.Row
-    with open(dat_file_filename, "w") as f:
-        for row in db.execute("SELECT * FROM words"):
-            print("\t".join([
-                row['gloss'] or '',
-                row['minor'] or '',
-                row['maori'] or '',
-                row['picture'] or '',
-                row['video'] or '',
-                row['handshape'] or '',
-                row['location']
-            ]), file=f)
+    datfile.write_datfile(db, dat_file_filename)
+    db.close()
 
 # The SQLite database is used by all primary applications other than the Android application.
 # It includes a table containing the core dictionary data (words), and references to assets (videos).
 # Generally, vocabulary follows historical terminology rather than aligning with Signbank at this stage.
 
 
-def write_sqlitefile(data, database_filename):
+def write_sqlitefile(data, database_filename, batch_size=None, search_index=False, workers=None):
     if os.path.exists(database_filename):
         os.unlink(database_filename)
-    db = sqlite3.connect(database_filename)
+    db = sqlite3.connect(database_filename, isolation_level=None)
+    batch_size = batch_size or SQLITE_BATCH_SIZE
+    workers = workers or SQLITE_TRANSFORM_WORKERS
+
+    # The database is rebuilt from scratch every time, so there is nothing to
+    # protect if the build is interrupted part way through - trade durability for
+    # load speed until the data is written.
+    db.execute("PRAGMA journal_mode = OFF")
+    db.execute("PRAGMA synchronous = OFF")
+    db.execute(f"PRAGMA cache_size = -{SQLITE_CACHE_SIZE_KB}")
 
     version = datetime.utcnow().strftime("%Y%m%d")
     db.execute(f"PRAGMA user_version = {version}")
 
-    db.execute(
-        """
-        create table words (
-          gloss, minor, maori, picture, video, handshape, location, location_identifier, variant_number, target, age_groups,
-          contains_numbers boolean, hint, id PRIMARY KEY, inflection_manner_and_degree boolean, inflection_plural boolean,
-          inflection_temporal boolean, is_directional boolean, is_fingerspelling boolean, is_locatable boolean,
-          one_or_two_handed boolean, related_to, usage, usage_notes, word_classes, gloss_normalized,
-          minor_normalized, maori_normalized
-        )
-      """
-    )
+    db.executescript(SQLITE_SCHEMA)
+    db.execute("BEGIN")
 
-    for entry in data:
-        target = "{}|{}|{}".format(
-            normalise(entry['gloss_main']), normalise(entry['gloss_secondary']), normalise(entry['gloss_maori']))
-
-        # Transform 'True'/'False' to boolean values - 0/1
-        entry = {k: v if v not in ("True", "False") else (
-            1 if v == "True" else 0) for k, v in entry.items()}
-
-        # Augment entry with additional attributes
-        entry.update({
-            "target": target,
-            "gloss_normalized": normalise(entry["gloss_main"]),
-            "minor_normalized": normalise(entry["gloss_secondary"]),
-            "maori_normalized": normalise(entry["gloss_maori"]),
-            "location_identifier": entry["location_name"],
-            "location": normalize_location(entry["location_name"])
-        })
-        db.execute(
-            """
-            INSERT INTO words VALUES(
-              :gloss_main,
-              :gloss_secondary,
-              :gloss_maori,
-              '',
-              '',
-              :handshape,
-              :location,
-              :location_identifier,
-              :variant_number,
-              :target,
-              :age_groups,
-              :contains_numbers,
-              :hint,
-              :id,
-              :inflection_manner_and_degree,
-              :inflection_plural,
-              :inflection_temporal,
-              :is_directional,
-              :is_fingerspelling,
-              :is_locatable,
-              :one_or_two_handed,
-              :related_to,
-              :usage,
-              :usage_notes,
-              :word_classes,
-              :gloss_normalized,
-              :minor_normalized,
-              :maori_normalized
-            ) ON CONFLICT DO NOTHING
-          """, entry)
-        add_examples(entry, db)
-        add_topics(entry, db)
-    db.commit()
+    for words, examples, topics, word_topics in transform_glosses(data, workers, batch_size):
+        _insert_batches(db, words, examples, topics, word_topics)
+    db.execute("COMMIT")
+    for table in ["words", "examples", "topics", "word_topics"]:
+        metrics.count(f"rows.{table}", db.execute(f"SELECT count(*) FROM {table}").fetchone()[0])
+
+    # Indexes are cheaper to build once over the loaded data than to maintain
+    # row by row during the load
+    db.executescript(SQLITE_INDEXES)
+    if search_index:
+        build_search_index(db)
     db.close()
 
 
-def add_topics(entry, db):
-    db.execute(
-        "CREATE TABLE IF NOT EXISTS topics (name varchar PRIMARY KEY UNIQUE)")
-    db.execute("CREATE TABLE IF NOT EXISTS word_topics (word_id, topic_name)")
-    for topic_name in entry["semantic_field"].split("; "):
-        topic_name = topic_name.strip()
-        if not topic_name:
-            continue
-        db.execute("INSERT INTO topics VALUES (:name) ON CONFLICT DO NOTHING",
-                   {"name": topic_name})
-        db.execute("INSERT INTO word_topics VALUES (:word_id, :topic_name) ON CONFLICT DO NOTHING",
-                   {"word_id":  entry["id"], "topic_name": topic_name})
+SQLITE_BATCH_SIZE = 5000
+SQLITE_CACHE_SIZE_KB = 64 * 1024
+SQLITE_TRANSFORM_WORKERS = int(os.getenv("SQLITE_TRANSFORM_WORKERS", 1))
+
+SQLITE_SCHEMA = """
+    create table words (
+      gloss, minor, maori, picture, video, handshape, location, location_identifier, variant_number, target, age_groups,
+      contains_numbers boolean, hint, id PRIMARY KEY, inflection_manner_and_degree boolean, inflection_plural boolean,
+      inflection_temporal boolean, is_directional boolean, is_fingerspelling boolean, is_locatable boolean,
+      one_or_two_handed boolean, related_to, usage, usage_notes, word_classes, gloss_normalized,
+      minor_normalized, maori_normalized
+    );
+    CREATE TABLE topics (name varchar PRIMARY KEY UNIQUE);
+    CREATE TABLE word_topics (word_id, topic_name);
+    CREATE TABLE examples (word_id, display_order, sentence, translation, video);
+"""
+
+SQLITE_INDEXES = """
+    CREATE INDEX idx_examples_word_id ON examples (word_id, display_order);
+    CREATE INDEX idx_word_topics_word_id ON word_topics (word_id);
+    CREATE INDEX idx_word_topics_topic_name ON word_topics (topic_name);
+    CREATE INDEX idx_words_gloss_normalized ON words (gloss_normalized);
+    CREATE INDEX idx_words_minor_normalized ON words (minor_normalized);
+    CREATE INDEX idx_words_maori_normalized ON words (maori_normalized);
+    CREATE INDEX idx_words_handshape ON words (handshape);
+    CREATE INDEX idx_words_location ON words (location);
+"""
 
-def add_examples(entry, db):
-    db.execute(
-        "CREATE TABLE IF NOT EXISTS examples (word_id, display_order, sentence, translation, video)")
+##
+# Optional full text search index, so apps can search glosses and their
+# translations without scanning every row of words. The unicode61 tokenizer
+# with remove_diacritics folds case and macrons/accents in search terms, so
+# "māori" matches "maori". Prefix indexes on the first 2 and 3
+# characters make search-as-you-type queries (`MATCH 'ha*'`) cheap. The indexed
+# text is passed through normalise() first, so the index folds exactly the same
+# characters as the target and *_normalized columns.
+#
+#   SELECT words.* FROM words_search JOIN words ON words.id = words_search.word_id
+#   WHERE words_search MATCH 'hap*' ORDER BY rank
+
+SQLITE_SEARCH_INDEX = """
+    CREATE VIRTUAL TABLE words_search USING fts5(
+      word_id UNINDEXED, gloss, minor, maori, usage_notes, examples,
+      tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+    );
+    INSERT INTO words_search (word_id, gloss, minor, maori, usage_notes, examples)
+    SELECT words.id, words.gloss_normalized, words.minor_normalized, words.maori_normalized,
+           normalise(words.usage_notes),
+           normalise((SELECT group_concat(translation, ' ') FROM examples WHERE examples.word_id = words.id))
+    FROM words;
+    INSERT INTO words_search (words_search) VALUES ('optimize');
+"""
+
+
+def build_search_index(db):
+    db.create_function("normalise", 1, lambda s: normalise(s) if s else s, deterministic=True)
+    db.executescript(SQLITE_SEARCH_INDEX)
+
+
+def _insert_batches(db, words, examples, topics, word_topics):
+    db.executemany(
+        "INSERT INTO words VALUES (?, ?, ?, '', '', ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+        " ON CONFLICT DO NOTHING", words)
+    db.executemany("INSERT INTO examples VALUES (?, ?, ?, ?, NULL)", examples)
+    db.executemany("INSERT INTO topics VALUES (?) ON CONFLICT DO NOTHING", topics)
+    db.executemany("INSERT INTO word_topics VALUES (?, ?)", word_topics)
 
-    for i in [1, 2, 3, 4]:
-        sentence = entry[f"videoexample{i}"]
-        if not sentence:
-            continue
 
-        db.execute(
-            "INSERT INTO examples VALUES (:word_id, :display_order, :sentence, :translation, NULL)",
-            {
-                "word_id": entry["id"],
-                "display_order": i,
-                "sentence": sentence,
-                "translation": entry[f"videoexample{i}_translation"]
-            }
-        )
+##
+# Export rows are turned into rows for each table a chunk of batch_size glosses
+# at a time. The columns needed are picked out of each export row with a single
+# itemgetter, and the rest of the work is done on the resulting tuples, which
+# are cheap to send to another process: with more than one worker, chunks are
+# transformed by a pool of processes while the next are read, and written in
+# the order they were read, so the database is the same whatever the number of
+# workers. Reading the export and writing the database stay in this process.
+
+# The export columns of the words table, in column order (less the columns
+# derived from them)
+WORD_COLUMNS = [
+    "gloss_main", "gloss_secondary", "gloss_maori", "handshape", "location_name", "variant_number", "age_groups",
+    "contains_numbers", "hint", "id", "inflection_manner_and_degree", "inflection_plural", "inflection_temporal",
+    "is_directional", "is_fingerspelling", "is_locatable", "one_or_two_handed", "related_to", "usage",
+    "usage_notes", "word_classes",
+]
+EXAMPLE_COLUMNS = [column for i in [1, 2, 3, 4] for column in (f"videoexample{i}", f"videoexample{i}_translation")]
+GLOSS_COLUMNS = WORD_COLUMNS + ["semantic_field"] + EXAMPLE_COLUMNS
+
+project_gloss = operator.itemgetter(*GLOSS_COLUMNS)
+
+_WORD_COLUMN_COUNT = len(WORD_COLUMNS)
+_ID = WORD_COLUMNS.index("id")
+# 'True'/'False' are stored as 1/0
+_BOOLEANS = {"True": 1, "False": 0}
+
+
+def transform_gloss_chunk(glosses):
+    """
+    The rows to insert into the words, examples, topics and word_topics tables
+    for a list of export rows projected with project_gloss. Word rows leave out
+    the picture and video columns, which are filled in once assets are linked.
+    """
+    words, examples, topics, word_topics = [], [], [], []
+    boolean = _BOOLEANS.get
+    for gloss in glosses:
+        values = [boolean(value, value) for value in gloss[:_WORD_COLUMN_COUNT]]
+        gloss_normalized = normalise(gloss[0])
+        minor_normalized = normalise(gloss[1])
+        maori_normalized = normalise(gloss[2])
+        words.append((
+            *values[:4], normalize_location(gloss[4]), values[4], values[5],
+            f"{gloss_normalized}|{minor_normalized}|{maori_normalized}", *values[6:],
+            gloss_normalized, minor_normalized, maori_normalized,
+        ))
+
+        word_id = gloss[_ID]
+        for topic_name in gloss[_WORD_COLUMN_COUNT].split("; "):
+            topic_name = topic_name.strip()
+            if topic_name:
+                topics.append((topic_name,))
+                word_topics.append((word_id, topic_name))
+
+        example_fields = gloss[_WORD_COLUMN_COUNT + 1:]
+        for i in range(4):
+            sentence = example_fields[2 * i]
+            if sentence:
+                examples.append((word_id, i + 1, sentence, example_fields[2 * i + 1]))
+    return words, examples, topics, word_topics
+
+
+def transform_glosses(data, workers=1, chunk_size=SQLITE_BATCH_SIZE):
+    """
+    Yields (words, examples, topics, word_topics) rows for each chunk of
+    chunk_size glosses of an export, in order, transforming up to `workers`
+    chunks at once in other processes.
+    """
+    data = iter(data)
+    chunks = iter(lambda: [project_gloss(entry) for entry in islice(data, chunk_size)], [])
+    if workers <= 1:
+        yield from map(transform_gloss_chunk, chunks)
+        return
+
+    # Forked, like the image processing workers, as the build script can't be
+    # imported again by a spawned process. A few chunks are queued per worker so
+    # that none are left waiting, without reading the whole export in ahead.
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork")) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(transform_gloss_chunk, chunk))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
 
 def copy_images_to_one_folder(source, dest):
+    """
+    Recreates dest with every PNG from source. Files are hardlinked rather than
+    copied where possible, so this costs no extra disk space or writes; image
+    processing breaks the link before changing a file.
+    """
     if (os.path.isdir(dest)):
         shutil.rmtree(dest)
     os.makedirs(dest)
 
-    # Warning: This is very shell-injectable
-    os.system(f"cp {source}/*.png {dest}/ 2>/dev/null")
+    counts = {"hardlink": 0, "reflink": 0, "copy": 0}
+    with os.scandir(source) as entries:
+        for entry in entries:
+            if entry.name.endswith(".png") and not entry.name.startswith(".") and entry.is_file():
+                method = filesystem.link_or_copy(entry.path, os.path.join(dest, entry.name))
+                counts[method] += 1
+
+    logger.info(f"Merged {sum(counts.values())} images into {dest} "
+                f"({counts['hardlink']} hardlinked, {counts['reflink']} reflinked, {counts['copy']} copied)")
+    return counts
 
 # Helper functions
 
 
-def normalize_location(location_str):
-    return re.sub(r'\A\d{2} - ', '', location_str)
+_LOCATION_NUMBER = re.compile(r'\A\d{2} - ')
 
-##
-# Replace accented characters with their lowercased, unaccented equivalents.
-# Note that this is a non-exhaustive list, and there are more resilient ways to do this.
-
-
-def normalise(s):
-    return (s.lower()
-            .replace("ā", "a")
-             .replace("ē", "e")
-            .replace("é", "e")
-             .replace("ī", "i")
-            .replace("ō", "o")
-            .replace("ū", "u"))
+
+def normalize_location(location_str):
+    return _LOCATION_NUMBER.sub('', location_str)
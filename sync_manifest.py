@@ -0,0 +1,101 @@
+import os
+import sqlite3
+from email.utils import formatdate
+
+##
+# The sync manifest records what we know about each asset we have downloaded
+# from Signbank, so that later runs can ask S3 whether it has changed (with a
+# conditional GET) rather than either trusting a stale file or downloading
+# everything again. It lives alongside the assets, so that caching the asset
+# folder between CI runs also caches the manifest.
+
+MANIFEST_FILENAME = ".sync-manifest.db"
+
+
+def open_manifest(folder):
+    db = sqlite3.connect(os.path.join(folder, MANIFEST_FILENAME))
+    db.row_factory = sqlite3.Row
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS assets (
+          filename PRIMARY KEY, url, etag, last_modified, size integer, sha256
+        )
+      """
+    )
+    # Files that have passed asset_integrity's checks, as they were when checked
+    db.execute("CREATE TABLE IF NOT EXISTS verified (filename PRIMARY KEY, size integer, mtime_ns integer)")
+    return db
+
+
+def lookup(db, filename):
+    return db.execute("SELECT * FROM assets WHERE filename = ?", (filename,)).fetchone()
+
+
+def record(db, filename, url, etag, last_modified, size, sha256):
+    db.execute(
+        """
+        INSERT INTO assets (filename, url, etag, last_modified, size, sha256)
+                    VALUES (:filename, :url, :etag, :last_modified, :size, :sha256)
+                    ON CONFLICT (filename) DO UPDATE SET
+                      url = excluded.url, etag = excluded.etag, last_modified = excluded.last_modified,
+                      size = excluded.size, sha256 = excluded.sha256
+        """, {
+            'filename': filename,
+            'url': url,
+            'etag': etag,
+            'last_modified': last_modified,
+            'size': size,
+            'sha256': sha256
+        }
+    )
+
+
+def forget(db, filename):
+    db.execute("DELETE FROM assets WHERE filename = ?", (filename,))
+    db.execute("DELETE FROM verified WHERE filename = ?", (filename,))
+
+
+def verified(db):
+    """
+    The (size, mtime_ns) of each file when it was last verified, by filename.
+    """
+    return {row['filename']: (row['size'], row['mtime_ns']) for row in db.execute("SELECT * FROM verified")}
+
+
+def record_verified(db, filename, size, mtime_ns):
+    db.execute("INSERT INTO verified VALUES (?, ?, ?) ON CONFLICT (filename) DO UPDATE SET "
+               "size = excluded.size, mtime_ns = excluded.mtime_ns", (filename, size, mtime_ns))
+
+
+def is_current(entry, path, url):
+    """
+    True if `path` is the file described by the manifest `entry`, downloaded from
+    `url`. Used to decide whether a file can be trusted without asking S3.
+    """
+    return (entry is not None
+            and entry['url'] == url
+            and os.path.exists(path)
+            and os.path.getsize(path) == entry['size'])
+
+
+def conditional_headers(entry, path, url):
+    """
+    Headers for a conditional GET of `url` into `path`, or no headers if the
+    file has to be downloaded regardless. Files we have no manifest entry for
+    (e.g. downloaded before the manifest existed) are revalidated against their
+    modification time.
+    """
+    if not os.path.exists(path):
+        return {}
+    if entry is None:
+        return {'If-Modified-Since': formatdate(os.path.getmtime(path), usegmt=True)}
+    if entry['url'] != url:
+        # The asset now points somewhere else, so what we have can't be compared
+        return {}
+
+    headers = {}
+    if entry['etag']:
+        headers['If-None-Match'] = entry['etag']
+    if entry['last_modified']:
+        headers['If-Modified-Since'] = entry['last_modified']
+    return headers